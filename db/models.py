@@ -5,6 +5,7 @@ from sqlalchemy import (
     JSON,
     Boolean,
     Column,
+    Computed,
     DateTime,
     Float,
     ForeignKey,
@@ -133,6 +134,7 @@ class LegalProcess(Base):
     valor_causa = Column(Float, nullable=True)
     start_date = Column(DateTime(timezone=True), nullable=True)
     last_update = Column(DateTime(timezone=True), nullable=True)
+    last_synced_at = Column(DateTime(timezone=True), index=True, nullable=True)  # última consulta do cron_sync
     summary_content = Column(Text, nullable=True)
     analysis_content = Column(JSON, nullable=True)
     raw_data = Column(JSON, nullable=True)  # Campo para guardar o JSON bruto do Jus.br
@@ -256,6 +258,14 @@ class ProcessDocument(Base):
     external_id = Column(String, index=True, nullable=True)  # idOrigem ou idCodex
     name = Column(String, nullable=False)
     document_type = Column(String, nullable=True)
+    # document_type minúsculo e sem acento (unaccent não é IMMUTABLE, por isso o translate)
+    doc_type_norm = Column(
+        Text,
+        Computed(
+            "translate(lower(document_type), 'áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')",
+            persisted=True,
+        ),
+    )
     juntada_date = Column(DateTime(timezone=True), nullable=False)
     file_type = Column(String, nullable=True)  # ex: application/pdf
     file_size = Column(Integer, nullable=True)
@@ -280,6 +290,7 @@ class ProcessDocument(Base):
 
     __table_args__ = (
         UniqueConstraint("process_id", "sequence", name="uq_doc_process_sequence"),
+        Index("ix_pd_process_type_norm", "process_id", "doc_type_norm"),
     )
 
 
@@ -387,6 +398,8 @@ class EmailThread(Base):
     first_email_date = Column(DateTime)
     last_email_date = Column(DateTime, index=True)
     participants = Column(JSON)
+    # Mantido pelo repositório a cada persistência (evita COUNT ... GROUP BY no batch)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0", index=True)
 
     messages = relationship(
         "EmailMessage",
@@ -475,6 +488,8 @@ class WhatsappMessage(Base):
 
     __table_args__ = (
         UniqueConstraint("conversation_id", "external_id", name="uq_wpp_conv_ext_id"),
+        # histórico de uma conversa em ordem cronológica
+        Index("ix_wpp_msg_conv_ts", "conversation_id", "message_timestamp"),
     )
 
 
@@ -14,6 +14,10 @@ def custom_json_serializer(*args, **kwargs) -> str:
 engine = create_engine(
     settings.DATABASE_URL,
     json_serializer=custom_json_serializer,
-    connect_args={"client_encoding": "utf8"}
+    connect_args={"client_encoding": "utf8"},
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,  # descarta conexões derrubadas pelo servidor antes de usar
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
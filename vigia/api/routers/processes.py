@@ -272,7 +272,7 @@ async def run_transit_analysis_action(
     ):
         message = f"✅ Trânsito em julgado detectado por IA para o processo **{proc.process_number}**."
         embed = create_transit_embed(proc.process_number, analysis_result)
-        send_discord_notification(message, embed)
+        await send_discord_notification(message, embed)
 
     return analysis_result
 
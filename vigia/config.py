@@ -70,6 +70,12 @@ class Settings(BaseSettings):
 
     # ─────────── Banco de Dados (PostgreSQL) ────────────
     DATABASE_URL: str
+    # andamentos do CPJ lidos/inseridos em páginas deste tamanho (limita memória)
+    CPJ_ANDAMENTOS_PAGE_SIZE: int = Field(5000, env="CPJ_ANDAMENTOS_PAGE_SIZE")
+    # pool de conexões por processo (pipelines concorrentes + gravações em segundo plano)
+    DB_POOL_SIZE: int = Field(10, env="DB_POOL_SIZE")
+    DB_MAX_OVERFLOW: int = Field(10, env="DB_MAX_OVERFLOW")
+    DB_POOL_RECYCLE_SECONDS: int = Field(3600, env="DB_POOL_RECYCLE_SECONDS")
 
     # ───────────── Redis / Celery ──────────────
     REDIS_HOST: str = "redis"
@@ -88,6 +94,12 @@ class Settings(BaseSettings):
     JUSBR_CLIENT_ID: str
     JUSBR_REDIRECT_URI: str
     JUSBR_AUTH_TOKEN_EXPIRATION_SECONDS: int = 3000  # 50 min
+    # nº máximo de consultas simultâneas ao Jus.br no cron de sincronização
+    CRON_SYNC_CONCURRENCY: int = Field(20, env="CRON_SYNC_CONCURRENCY")
+    # grupos consultados há menos de N horas são pulados pelo cron
+    CRON_SYNC_MIN_INTERVAL_HOURS: int = Field(6, env="CRON_SYNC_MIN_INTERVAL_HOURS")
+    # nº máximo de análises de status de processo (LLM) simultâneas em lote
+    PROCESS_ANALYSIS_CONCURRENCY: int = Field(8, env="PROCESS_ANALYSIS_CONCURRENCY")
 
     # ───────────── LLM Providers ──────────────
     LLM_PROVIDER: str = "gemini"
@@ -95,6 +107,12 @@ class Settings(BaseSettings):
     OLLAMA_API_URL: str | None = None
     OLLAMA_MODEL: str | None = None
     WHISPER_MODEL: str = "turbo"
+    # chamadas simultâneas ao provedor de LLM por processo (todas as agentes dividem o mesmo limite)
+    LLM_MAX_CONCURRENCY: int = Field(8, env="LLM_MAX_CONCURRENCY")
+    # validade (s) do cache de respostas do LLM no Redis, por hash do prompt (0 = desligado)
+    LLM_CACHE_TTL_SECONDS: int = Field(86400, env="LLM_CACHE_TTL_SECONDS")
+    # processos p/ reparar JSON malformado das LLMs em lote (0 = inline, sem pool)
+    JSON_REPAIR_WORKERS: int = Field(0, env="JSON_REPAIR_WORKERS")
 
     # ───────── Evolution / WhatsApp ───────────
     EVOLUTION_BASE_URL: str
@@ -105,9 +123,13 @@ class Settings(BaseSettings):
     PIPEDRIVE_DOMAIN: str
     PIPEDRIVE_API_TOKEN_WHATSAPP: str
     PIPEDRIVE_API_TOKEN_EMAIL: str
+    # validade (s) do cache de pessoa/negócio por telefone no contexto do WhatsApp
+    PIPEDRIVE_CACHE_TTL_SECONDS: int = Field(120, env="PIPEDRIVE_CACHE_TTL_SECONDS")
 
     # ────────────── Graph / Email ─────────────
     GRAPH_BASE_URL: str = "https://graph.microsoft.com/v1.0"
+    # $top das listagens de mensagens (menos páginas = menos round trips)
+    GRAPH_PAGE_SIZE: int = Field(250, env="GRAPH_PAGE_SIZE")
     TENANT_ID: str
     CLIENT_ID: str
     CLIENT_SECRET: str
@@ -118,6 +140,10 @@ class Settings(BaseSettings):
     EMAIL_ACCOUNTS: List[str] = Field(default_factory=list)
     SUBJECT_FILTER: List[str] = Field(default_factory=list)
     IGNORED_RECIPIENT_PATTERNS: List[str] = Field(default_factory=list)
+    # nº máximo de threads de e-mail buscadas em paralelo na Graph API
+    EMAIL_THREAD_FETCH_WORKERS: int = Field(8, env="EMAIL_THREAD_FETCH_WORKERS")
+    # nº máximo de contas importadas em paralelo
+    EMAIL_ACCOUNT_IMPORT_WORKERS: int = Field(4, env="EMAIL_ACCOUNT_IMPORT_WORKERS")
 
     # ────────────── Validadores custom ─────────────
     @property
@@ -1,5 +1,6 @@
 import structlog
-from typing import Dict
+from typing import Dict, List
+from sqlalchemy import Boolean, exists, func, literal_column, select, update
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 
@@ -15,87 +16,110 @@ class PostgresEmailRepository(EmailRepositoryPort):
     
     def save_threads_and_messages(self, threads_data: Dict[str, Dict]) -> int:
         db: Session = SessionLocal()
-        total_messages_saved = 0
         try:
             # Garante que temos um usuário padrão para atribuir as negociações
             default_agent = crud.get_or_create_default_user(db)
             if not default_agent:
                 raise Exception("Não foi possível encontrar ou criar um agente padrão.")
 
+            # Passo 1: UPSERT de todas as threads do lote num único statement
+            thread_rows = []
             for conv_id, data in threads_data.items():
-                # Passo 1: Verifica se a thread já existe
-                db_thread = db.query(models.EmailThread).filter_by(conversation_id=conv_id).first()
-
                 # Normaliza participants para list (pode ter vindo como set do enrichment)
                 participants = data.get("participants") or []
                 if isinstance(participants, set):
                     participants = sorted(participants)
+                thread_rows.append({
+                    "conversation_id": conv_id,
+                    "subject": data["subject"],
+                    "first_email_date": data["first_email_date"],
+                    "last_email_date": data["last_email_date"],
+                    "participants": participants,
+                })
 
-                if not db_thread:
-                    # NOVA CONVERSA: cria Thread e Negociação
-                    db_thread = models.EmailThread(
-                        conversation_id=conv_id,
-                        subject=data["subject"],
-                        first_email_date=data["first_email_date"],
-                        last_email_date=data["last_email_date"],
-                        participants=participants,
-                    )
-                    db.add(db_thread)
-
-                    db_negotiation = models.Negotiation(
-                        email_thread=db_thread,
-                        assigned_agent=default_agent,
-                        status="active",
-                        priority="medium",
-                    )
-                    db.add(db_negotiation)
-                    logger.info("repository.new_thread_and_negotiation.created", conv_id=conv_id)
-                else:
-                    # THREAD EXISTENTE: atualiza campos básicos
-                    db_thread.subject = data["subject"]
-                    db_thread.last_email_date = data["last_email_date"]
-                    db_thread.participants = participants
+            # executemany: o SQLAlchemy pagina em INSERTs multi-linha (insertmanyvalues),
+            # sem estourar o limite de parâmetros do PG em lotes grandes
+            stmt = insert(models.EmailThread)
+            # THREAD EXISTENTE: atualiza campos básicos (first_email_date é preservado)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[models.EmailThread.conversation_id],
+                set_={
+                    "subject": stmt.excluded.subject,
+                    # nunca recua a data (lote parcial não apaga mensagens mais novas)
+                    "last_email_date": func.greatest(
+                        models.EmailThread.last_email_date, stmt.excluded.last_email_date
+                    ),
+                    "participants": stmt.excluded.participants,
+                },
+            ).returning(
+                models.EmailThread.conversation_id,
+                models.EmailThread.id,
+                # xmax = 0 só na linha recém-inserida: o próprio upsert diz quem é novo
+                # (um SELECT prévio corre contra importações paralelas de outras contas)
+                literal_column("xmax = 0", Boolean).label("inserted"),
+            )
+            thread_ids, new_thread_ids = {}, []
+            for conv_id, thread_id, inserted in db.execute(stmt, thread_rows):
+                thread_ids[conv_id] = thread_id
+                if inserted:
+                    new_thread_ids.append(thread_id)
 
-                db.flush()  # garante db_thread.id
+            # NOVAS CONVERSAS: cria as Negociações em massa
+            new_negotiations = [
+                {
+                    "email_thread_id": thread_id,
+                    "assigned_agent_id": default_agent.id,
+                    "status": "active",
+                    "priority": "medium",
+                }
+                for thread_id in new_thread_ids
+            ]
+            if new_negotiations:
+                db.execute(insert(models.Negotiation), new_negotiations)
+                logger.info("repository.new_threads_and_negotiations.created", count=len(new_negotiations))
 
-                # Passo 2: Inserção em massa de mensagens (com deduplicação local)
-                messages_to_insert = [
-                    {
-                        "thread_id": db_thread.id,
-                        "message_id": email_dto.id,
-                        "internet_message_id": email_dto.internet_message_id,
+            # Passo 2: Inserção em massa de mensagens do lote inteiro (com deduplicação local)
+            unique_rows, seen_msg_ids, seen_imids = [], set(), set()
+            for conv_id, data in threads_data.items():
+                thread_id = thread_ids[conv_id]
+                for email_dto in data["messages"]:
+                    mid = email_dto.id
+                    imid = email_dto.internet_message_id
+                    if mid in seen_msg_ids or (imid and imid in seen_imids):
+                        continue
+                    seen_msg_ids.add(mid)
+                    if imid:
+                        seen_imids.add(imid)
+                    unique_rows.append({
+                        "thread_id": thread_id,
+                        "message_id": mid,
+                        "internet_message_id": imid,
                         "sender": email_dto.from_address,
                         "body": email_dto.body_content,
                         "sent_datetime": email_dto.sent_datetime,
                         "has_attachments": email_dto.has_attachments,
                         "importance": email_dto.importance,
-                    }
-                    for email_dto in data["messages"]
-                ]
+                    })
 
-                if messages_to_insert:
-                    # Dedup no lote por message_id e internet_message_id
-                    unique_rows, seen_msg_ids, seen_imids = [], set(), set()
-                    for row in messages_to_insert:
-                        mid = row["message_id"]
-                        imid = row.get("internet_message_id")
-                        if mid in seen_msg_ids or (imid and imid in seen_imids):
-                            continue
-                        seen_msg_ids.add(mid)
-                        if imid:
-                            seen_imids.add(imid)
-                        unique_rows.append(row)
+            total_messages_saved = 0
+            if unique_rows:
+                # Catch-all: ignora qualquer conflito de unicidade (message_id, internet_message_id, etc.)
+                stmt = insert(models.EmailMessage).on_conflict_do_nothing().returning(models.EmailMessage.id)
+                total_messages_saved = len(db.execute(stmt, unique_rows).scalars().all())
 
-                    if unique_rows:
-                        stmt = insert(models.EmailMessage).values(unique_rows)
-                        # Catch-all: ignora qualquer conflito de unicidade (message_id, internet_message_id, etc.)
-                        stmt = stmt.on_conflict_do_nothing().returning(models.EmailMessage.id)
-                        result = db.execute(stmt)
-                        inserted = len(result.scalars().all())
-                        total_messages_saved += inserted
+            # Contagem materializada (recalculada no banco; corrige threads antigas tocadas)
+            db.execute(
+                update(models.EmailThread)
+                .where(models.EmailThread.id.in_(list(thread_ids.values())))
+                .values(message_count=(
+                    select(func.count(models.EmailMessage.id))
+                    .where(models.EmailMessage.thread_id == models.EmailThread.id)
+                    .scalar_subquery()
+                ))
+            )
 
             db.commit()
-            logger.info("repository.save_threads.success", count=len(threads_data))
+            logger.info("repository.save_threads.success", count=len(threads_data), messages=total_messages_saved)
             return total_messages_saved
         except Exception:
             logger.exception("repository.save_threads.error")
@@ -103,3 +127,42 @@ class PostgresEmailRepository(EmailRepositoryPort):
             return 0
         finally:
             db.close()
+
+    def get_message_counts(self, conversation_ids: List[str]) -> Dict[str, int]:
+        if not conversation_ids:
+            return {}
+        db: Session = SessionLocal()
+        try:
+            rows = db.execute(
+                select(models.EmailThread.conversation_id, models.EmailThread.message_count)
+                .where(models.EmailThread.conversation_id.in_(conversation_ids))
+            ).all()
+            return dict(rows)
+        finally:
+            db.close()
+
+    def backfill_message_counts(self) -> int:
+        db: Session = SessionLocal()
+        try:
+            # Threads anteriores à coluna ficaram com 0; só as zeradas com mensagens são tocadas,
+            # então depois da primeira execução a chamada é praticamente um no-op
+            result = db.execute(
+                update(models.EmailThread)
+                .where(models.EmailThread.message_count == 0)
+                .where(exists().where(models.EmailMessage.thread_id == models.EmailThread.id))
+                .values(message_count=(
+                    select(func.count(models.EmailMessage.id))
+                    .where(models.EmailMessage.thread_id == models.EmailThread.id)
+                    .scalar_subquery()
+                ))
+            )
+            db.commit()
+            if result.rowcount:
+                logger.info("repository.backfill_message_counts.success", count=result.rowcount)
+            return result.rowcount
+        except Exception:
+            logger.exception("repository.backfill_message_counts.error")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
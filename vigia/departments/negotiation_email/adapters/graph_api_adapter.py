@@ -2,7 +2,8 @@ import structlog
 import requests
 from requests.adapters import HTTPAdapter, Retry
 from datetime import datetime, timezone
-from typing import Generator, List
+from typing import Dict, Generator, Iterator, List, Optional
+from urllib.parse import quote
 
 from vigia.config import settings
 from ..ports.graph_client_port import GraphClientPort
@@ -17,6 +18,7 @@ class GraphApiAdapter(GraphClientPort):
     Responsável pela comunicação HTTP, retries, paginação e conversão para DTOs.
     """
     _TIMEOUT = (5, 60)  # (connect, read)
+    _BATCH_SIZE = 20  # limite do JSON batching do Graph
 
     def __init__(self) -> None:
         self.base_url = settings.GRAPH_BASE_URL.rstrip("/")
@@ -35,27 +37,32 @@ class GraphApiAdapter(GraphClientPort):
         log.info("graph_adapter.fetch_mail_folders.success", total=len(folders))
         return folders
 
-    def fetch_messages_in_folder(self, account_email: str, folder_id: str) -> List[EmailDTO]:
+    def fetch_messages_in_folder(
+        self, account_email: str, folder_id: str, odata_filter: Optional[str] = None
+    ) -> Iterator[EmailDTO]:
         log = logger.bind(account_email=account_email, folder_id=folder_id)
-        log.info("graph_adapter.fetch_messages_in_folder.start")
+        log.info("graph_adapter.fetch_messages_in_folder.start", odata_filter=odata_filter)
 
         fields = [
             "id", "subject", "body", "sentDateTime", "isRead", "conversationId",
             "hasAttachments", "from", "toRecipients", "ccRecipients",
             "importance", "isReadReceiptRequested", "internetMessageId"
         ]
-        select_query = f"$select={','.join(fields)}"
-        url = (
-            f"{self.base_url}/users/{account_email}/mailFolders/{folder_id}/messages"
-            f"?$orderby=sentDateTime desc&{select_query}&$top=50"
-        )
-        emails = [
-            self._to_email_dto(item)
-            for page in self._paginate(url, log)
-            for item in page.get("value", [])
-        ]
-        log.info("graph_adapter.fetch_messages_in_folder.success", total=len(emails))
-        return emails
+        url = f"{self.base_url}/users/{account_email}/mailFolders/{folder_id}/messages"
+        params = {"$select": ",".join(fields), "$top": str(settings.GRAPH_PAGE_SIZE)}
+        if odata_filter:
+            # com $filter o Graph rejeita $orderby em campo fora do filtro (InefficientFilter)
+            params["$filter"] = odata_filter
+        else:
+            params["$orderby"] = "sentDateTime desc"
+        # gerador: só a página corrente fica em memória
+        total = 0
+        for page in self._paginate((url, params), log):
+            items = page.get("value", [])
+            total += len(items)
+            for item in items:
+                yield self._to_email_dto(item)
+        log.info("graph_adapter.fetch_messages_in_folder.success", total=total)
 
     def fetch_conversation_thread(self, account_email: str, conversation_id: str) -> List[EmailDTO]:
         log = logger.bind(account_email=account_email, conversation_id=conversation_id)
@@ -83,12 +90,57 @@ class GraphApiAdapter(GraphClientPort):
         log.info("graph_adapter.fetch_conversation_thread.success", total=len(emails))
         return emails
 
+    def fetch_conversation_counts(self, account_email: str, conversation_ids: List[str]) -> Dict[str, int]:
+        """Conta as mensagens de cada conversa via $batch (20 por requisição); falhas ficam fora do dict."""
+        log = logger.bind(account_email=account_email)
+        batch = []
+        for conv_id in conversation_ids:
+            odata_filter = quote(f"conversationId eq '{conv_id}'")
+            batch.append({
+                "method": "GET",
+                "url": f"/users/{account_email}/messages?$select=id&$top=1&$count=true&$filter={odata_filter}",
+                "headers": {"ConsistencyLevel": "eventual"},
+            })
+        counts: Dict[str, int] = {}
+        for conv_id, resp in zip(conversation_ids, self.batch_execute(batch)):
+            body = resp.get("body") or {}
+            if resp.get("status") == 200 and "@odata.count" in body:
+                counts[conv_id] = int(body["@odata.count"])
+        log.info("graph_adapter.fetch_conversation_counts.success", requested=len(conversation_ids), counted=len(counts))
+        return counts
+
+    def batch_execute(self, requests_: List[dict]) -> List[dict]:
+        """
+        Executa requisições relativas (`method`, `url`, `headers`) via JSON $batch, em lotes de 20.
+        Retorna as respostas na ordem de entrada; lotes que falharem viram `{"status": None}`.
+        """
+        responses: List[dict] = []
+        for i in range(0, len(requests_), self._BATCH_SIZE):
+            chunk = [
+                {"id": str(n), **req}
+                for n, req in enumerate(requests_[i:i + self._BATCH_SIZE])
+            ]
+            try:
+                data = self._post(f"{self.base_url}/$batch", {"requests": chunk})
+            except requests.RequestException:
+                responses.extend({"status": None} for _ in chunk)
+                continue
+            by_id = {resp.get("id"): resp for resp in data.get("responses", [])}
+            responses.extend(by_id.get(req["id"], {"status": None}) for req in chunk)
+        return responses
+
     def _build_session(self) -> requests.Session:
         session = requests.Session()
         retry_cfg = Retry(
             total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]
         )
-        session.mount("https://", HTTPAdapter(max_retries=retry_cfg))
+        # Contas × threads por conta compartilham a Session: o pool precisa comportar todas,
+        # senão conexões excedentes são descartadas e refazem o handshake TLS
+        pool_size = max(
+            10,
+            (settings.EMAIL_ACCOUNT_IMPORT_WORKERS or 1) * (settings.EMAIL_THREAD_FETCH_WORKERS or 1),
+        )
+        session.mount("https://", HTTPAdapter(pool_maxsize=pool_size, max_retries=retry_cfg))
         return session
 
     def _headers(self) -> dict[str, str]:
@@ -107,7 +159,15 @@ class GraphApiAdapter(GraphClientPort):
                 logger.exception("graph_adapter.request.error.unlogged_body")
             raise
 
-    
+    def _post(self, url: str, payload: dict) -> dict:
+        try:
+            resp = self.session.post(url, headers=self._headers(), timeout=self._TIMEOUT, json=payload)
+            resp.raise_for_status()
+            return resp.json()
+        except requests.RequestException as e:
+            logger.error("graph_adapter.request.error", url=url, status=getattr(e.response, "status_code", None), body=getattr(e.response, "text", None))
+            raise
+
     def _paginate(self, first: tuple[str, dict] | str, log):
         if isinstance(first, tuple):
             url, params = first
@@ -1,3 +1,4 @@
+import threading
 import time
 from typing import Dict, Optional
 
@@ -11,6 +12,8 @@ logger = structlog.get_logger(__name__)
 
 class TokenProvider:
     _token_cache: Dict[str, Dict] = {}
+    # Importação paralela: só uma thread renova o token; as demais reaproveitam o cache
+    _lock = threading.Lock()
     DEFAULT_SCOPE = "https://graph.microsoft.com/.default"
 
     def get_token(self, scope: Optional[str] = None) -> str:
@@ -20,6 +23,14 @@ class TokenProvider:
         if cached_token and time.time() < cached_token.get("expires_at", 0):
             return cached_token["access_token"]
 
+        with self._lock:
+            # outra thread pode ter renovado enquanto esperávamos o lock
+            cached_token = self._token_cache.get(target_scope)
+            if cached_token and time.time() < cached_token.get("expires_at", 0):
+                return cached_token["access_token"]
+            return self._acquire_token(target_scope)
+
+    def _acquire_token(self, target_scope: str) -> str:
         logger.info("token_provider.get_token.acquiring_new", scope=target_scope)
         url = (
             f"https://login.microsoftonline.com/{settings.TENANT_ID}/oauth2/v2.0/token"
@@ -10,7 +10,7 @@ from sqlalchemy.orm import Session
 from vigia.departments.negotiation_email.agents.judicial_jury_agents import ARBITER_SCHEMA
 from vigia.departments.negotiation_email.utils.jusbr_utils import build_timeline, build_evidence_index
 from vigia.departments.negotiation_email.utils import clean_html_body
-from vigia.departments.negotiation_email.utils.json_safety import safe_json_loads as _safe_json_loads
+from vigia.departments.negotiation_email.utils.json_safety import safe_json_loads_async as _safe_json_loads
 from vigia.services import database_service, pipedrive_service, llm_service
 from vigia.services.pipedrive_service import email_client
 from vigia.services.jusbr_service import jusbr_service
@@ -104,7 +104,7 @@ async def _ensure_legal_ctx_json(legal_context_summary: str) -> Optional[Dict[st
     solicita correção ao LLM com schema estrito.
     """
     try:
-        return _safe_json_loads(legal_context_summary)
+        return await _safe_json_loads(legal_context_summary)
     except Exception:
         pass
 
@@ -120,9 +120,10 @@ async def _ensure_legal_ctx_json(legal_context_summary: str) -> Optional[Dict[st
         "Você corrige saídas para JSON estrito.",
         correction_prompt,
         expects_json=True,
+        use_cache=True,  # só converte o mesmo conteúdo para JSON: idempotente
     )
     try:
-        return _safe_json_loads(fixed)
+        return await _safe_json_loads(fixed)
     except Exception:
         return None
 
@@ -700,6 +701,25 @@ def _save_judicial_analysis_to_db(db: Session, thread_id: int, analysis_json: Di
 # =============================================================================
 # DB helpers
 # =============================================================================
+def _with_session(fn, *args, **kwargs):
+    """Roda `fn(db, ...)` numa Session própria; usado via `asyncio.to_thread`
+    para que o I/O do banco não trave o event loop dos pipelines concorrentes."""
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+def _load_thread(db: Session, conversation_id: str) -> Optional[Tuple[Any, Optional[Dict[str, Any]], Optional[str]]]:
+    thread = db.query(models.EmailThread).filter(models.EmailThread.conversation_id == conversation_id).first()
+    if not thread:
+        logger.error("Thread %s não encontrada", conversation_id)
+        return None
+    thread_meta, full_history = get_thread_data_from_db(db, conversation_id)
+    return thread.id, thread_meta, full_history
+
+
 def get_thread_data_from_db(db: Session, conversation_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     thread = db.query(models.EmailThread).filter(models.EmailThread.conversation_id == conversation_id).first()
     if not thread:
@@ -744,7 +764,7 @@ async def run_adversarial_extraction(email_body: str) -> str:
     validation_report_str = await validator_agent.execute(email_body=email_body, json_extraction=initial_extraction)
 
     try:
-        validation_report = _safe_json_loads(validation_report_str)
+        validation_report = await _safe_json_loads(validation_report_str)
     except json.JSONDecodeError:
         logger.error("Falha ao decodificar o relatório de validação. Abortando refinamento.")
         return initial_extraction
@@ -777,18 +797,12 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
     logger.info("PIPELINE EMAIL • Iniciando para %s", conv_id)
 
     # ------------------ Carrega thread e meta ------------------
-    db = SessionLocal()
-    try:
-        thread = db.query(models.EmailThread).filter(models.EmailThread.conversation_id == conv_id).first()
-        if not thread:
-            logger.error("Thread %s não encontrada", conv_id)
-            return {}
-        thread_id = thread.id
-        thread_meta, full_history = get_thread_data_from_db(db, conv_id)
-        if not thread_meta:
-            return {}
-    finally:
-        db.close()
+    loaded = await asyncio.to_thread(_with_session, _load_thread, conv_id)
+    if not loaded:
+        return {}
+    thread_id, thread_meta, full_history = loaded
+    if not thread_meta:
+        return {}
 
     # ------------------ Contexto CRM ------------------
     raw_crm = await context_miner_agent.execute(thread_meta["subject"])
@@ -800,7 +814,7 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     if not numero_processo_crm:
         try:
-            subject_extraction = _safe_json_loads(await extraction_subject_agent.execute(thread_meta["subject"]))
+            subject_extraction = await _safe_json_loads(await extraction_subject_agent.execute(thread_meta["subject"]))
             numero_processo_crm = subject_extraction.get("numero_processo")
         except Exception:
             numero_processo_crm = None
@@ -846,9 +860,9 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
     extract_str = await extraction_manager_agent.execute(
         subject_extraction_str, legal_financial_extraction_str, stage_extraction_str
     )
-    extract_data = _safe_json_loads(extract_str)
+    extract_data = await _safe_json_loads(extract_str)
     extract_data = _split_propostas(extract_data)  # <-- ajuste de autoria das propostas
-    temp_data = _safe_json_loads(temp_str)
+    temp_data = await _safe_json_loads(temp_str)
     urgencia_final = _resolve_urgencia(temp_data)
 
     # ------------------ KPIs ------------------
@@ -867,7 +881,7 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
     pipedrive_actions_results: list = []
 
     try:
-        decision_json = _safe_json_loads(director_raw)
+        decision_json = await _safe_json_loads(director_raw)
         actions_to_execute = decision_json.get("actions")
         tool_name_direct = decision_json.get("name")
 
@@ -911,8 +925,8 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
         strategic_advocate_agent.execute(context_str),
     )
 
-    tese_conservadora_json = _safe_json_loads(tese_conservadora_str)
-    tese_estrategica_json = _safe_json_loads(tese_estrategica_str)
+    tese_conservadora_json = await _safe_json_loads(tese_conservadora_str)
+    tese_estrategica_json = await _safe_json_loads(tese_estrategica_str)
 
     max_attempts = 3
     advisor_json: Dict[str, Any] = {}
@@ -942,7 +956,7 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
             )
 
         try:
-            advisor_json = _safe_json_loads(advisor_raw)
+            advisor_json = await _safe_json_loads(advisor_raw)
             logger.info("Sucesso na decodificação do JSON do Júri na tentativa %d.", attempt)
             break
         except json.JSONDecodeError as e:
@@ -953,16 +967,13 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     # Persistência da análise do Júri (opcional)
     if "erro" not in advisor_json and save_result and thread_id:
-        db = SessionLocal()
-        try:
-            _save_judicial_analysis_to_db(
-                db=db,
-                thread_id=thread_id,
-                analysis_json=advisor_json,
-                theses={"conservative": tese_conservadora_json, "strategic": tese_estrategica_json},
-            )
-        finally:
-            db.close()
+        await asyncio.to_thread(
+            _with_session,
+            _save_judicial_analysis_to_db,
+            thread_id=thread_id,
+            analysis_json=advisor_json,
+            theses={"conservative": tese_conservadora_json, "strategic": tese_estrategica_json},
+        )
 
     # ------------------ Sumarizador ------------------
     logger.info("-- Gerando sumário formal")
@@ -974,7 +985,7 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
     }
     summary_raw = await formal_summarizer_agent.execute(json.dumps(summarizer_payload, ensure_ascii=False))
     try:
-        summary_json = _safe_json_loads(summary_raw)
+        summary_json = await _safe_json_loads(summary_raw)
     except json.JSONDecodeError as e:
         logger.error("Erro ao decodificar o JSON do sumário: %s", e)
         summary_json = {"erro": "summarizer output inválido", "raw": summary_raw}
@@ -1035,11 +1046,9 @@ async def run_department_pipeline(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     if save_result:
         logger.info("Salvando resultado da análise (%s)", conv_id)
-        db = SessionLocal()
-        try:
-            database_service.save_email_analysis_results(db=db, analysis_data=report)
-        finally:
-            db.close()
+        await asyncio.to_thread(
+            _with_session, database_service.save_email_analysis_results, analysis_data=report
+        )
 
     logger.info("PIPELINE EMAIL • Finalizado para %s", conv_id)
     return report
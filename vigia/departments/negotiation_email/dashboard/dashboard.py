@@ -11,11 +11,16 @@ Abas:
 # DEPENDÊNCIAS
 # --------------------------------------------------------------------------
 import os
+import re
+import glob
 import json
+import hashlib
+import tempfile
 import textwrap
+import contextlib
 import warnings
-import itertools
-from datetime import timedelta
+from datetime import date, timedelta
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
@@ -23,7 +28,9 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from sqlalchemy import create_engine
+from scipy import sparse
+from psycopg2.extras import register_default_json
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.pool import QueuePool
 
 import statsmodels.formula.api as smf
@@ -41,16 +48,41 @@ try:
     from wordcloud import WordCloud
 except ImportError:
     WordCloud = None
+try:
+    from tsdownsample import LTTBDownsampler
+except ImportError:
+    LTTBDownsampler = None
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+try:
+    import numba  # noqa: F401  (habilita engine="numba" no pandas)
+    NUMBA_ENGINE = {"engine": "numba", "engine_kwargs": {"parallel": True}}
+except ImportError:
+    NUMBA_ENGINE = {}
 
 warnings.filterwarnings("ignore", category=FutureWarning)
+# Copy-on-Write: filtros/slices viram views; só a coluna alterada é copiada
+# (já é o padrão a partir do pandas 3)
+if int(pd.__version__.split(".", 1)[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 st.set_page_config(page_title="Vigia | Dashboard E‑mail",
                    page_icon="📧", layout="wide")
 
 PLOTLY_TEMPLATE = "plotly_dark"
+MAX_PONTOS = 2000  # teto de pontos por trace enviado ao browser
+MOEDA_COL = st.column_config.NumberColumn(format="R$ %.2f")
+PARQUET_DIR = os.getenv("VIGIA_CACHE_DIR", "/tmp")
 DB_URI = (
     f"postgresql+psycopg2://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
     f"@{os.getenv('DB_HOST', 'postgres')}:5432/{os.getenv('POSTGRES_DB')}"
 )
+DATE_COLUMNS = ["created_at", "first_email_date", "last_email_date"]
+FLOAT_COLUMNS = ["tempo_resolucao_dias", "valor_proposta"]
+LABEL_COL = "rotulo_selecao"  # rótulo pré-calculado do seletor da aba individual
+CATEGORY_KEYS = ["status_acordo", "negociacao_estagio", "tom_da_conversa"]
 JSON_COLUMNS = [
     "extracted_data", 
     "temperature_assessment", 
@@ -61,6 +93,31 @@ JSON_COLUMNS = [
     "formal_summary"
 ]
 
+# Parsing de moeda ("R$ 1.234,56" → 1234.56), compilado uma única vez
+RE_VALOR        = re.compile(r"(\d[\d.,]*)")
+RE_NAO_NUMERICO = re.compile(r"[^\d,.-]")
+RE_SEP_MILHAR   = re.compile(r"(?<=\d)[.,](?=\d{3}(?:\D|$))")
+
+def _json_num(expr: str) -> str:
+    """Projeta uma folha JSON numérica como float (NULL se não for número)."""
+    return f"CASE WHEN json_typeof({expr}) = 'number' THEN ({expr})::text::float END"
+
+# Folhas JSON achatadas no próprio PostgreSQL (coluna → expressão SQL).
+# O pandas recebe o resultado já "flat", sem json_normalize no Python.
+JSON_FIELDS = {
+    "extracted_numero_processo":     "a.extracted_data->>'numero_processo'",
+    "extracted_nome_parte":          "a.extracted_data->>'nome_parte'",
+    "extracted_negociacao_estagio":  "COALESCE(a.extracted_data->>'negociacao_estagio',"
+                                     " a.extracted_data->>'estagio_negociacao')",
+    "extracted_tom_da_conversa":     "a.extracted_data->>'tom_da_conversa'",
+    "extracted_status_acordo":       "a.extracted_data->>'status_acordo'",
+    "extracted_proposta_valor":      "COALESCE(a.extracted_data->'proposta'->>'valor',"
+                                     " a.extracted_data->'proposta_atual'->>'valor')",
+    "temperature_engajamento":       _json_num("a.temperature_assessment->'engajamento'"),
+    "temperature_urgencia":          _json_num("a.temperature_assessment->'urgencia'"),
+    "director_acao_nome_ferramenta": "a.director_decision->'acao'->>'nome_ferramenta'",
+}
+
 # --------------------------------------------------------------------------
 # UTILITÁRIOS
 # --------------------------------------------------------------------------
@@ -68,99 +125,299 @@ def wrap_text(s: str, width: int = 80) -> str:
     return s if not isinstance(s, str) or len(s) <= width else textwrap.shorten(s, width, "…")
 
 def find_col(df: pd.DataFrame, keys: list[str]) -> str | None:
+    return _find_col_impl(tuple(df.columns), tuple(keys))
+
+@lru_cache(maxsize=128)
+def _find_col_impl(cols: tuple[str, ...], keys: tuple[str, ...]) -> str | None:
+    """Busca por substring (case-insensitive), memoizada por (colunas, chaves)."""
+    lowered = tuple(c.lower() for c in cols)
     for k in keys:
-        for c in df.columns:
-            if k.lower() in c.lower():
+        k = k.lower()
+        for c, low in zip(cols, lowered):
+            if k in low:
                 return c
     return None
 
-@st.cache_data(ttl=timedelta(minutes=5), show_spinner="🔄 Carregando dados do banco…")
-def read_email_data() -> pd.DataFrame:
-    engine = create_engine(DB_URI, poolclass=QueuePool, pool_size=3)
-    query = """
-      SELECT a.id AS analysis_id,
+def parse_moeda(s: pd.Series) -> pd.Series:
+    """"R$ 1.234,56" → 1234.56 (float64; NaN se não houver número)."""
+    return pd.to_numeric(
+        s.astype("string").str.extract(RE_VALOR)[0]
+         .str.replace(RE_NAO_NUMERICO, "", regex=True)
+         .str.replace(RE_SEP_MILHAR, "", regex=True)
+         .str.replace(",", ".", regex=False),
+        errors="coerce",
+    ).astype(float)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int = MAX_PONTOS) -> np.ndarray:
+    """Índices Largest-Triangle-Three-Buckets para `x` já ordenado."""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    if LTTBDownsampler:
+        return LTTBDownsampler().downsample(x, y, n_out=n_out)
+    bucket = (n - 2) / (n_out - 2)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        ini = int(i * bucket) + 1
+        fim = int((i + 1) * bucket) + 1
+        prox = min(int((i + 2) * bucket) + 1, n)
+        avg_x, avg_y = x[fim:prox].mean(), y[fim:prox].mean()
+        area = np.abs((x[a] - avg_x) * (y[ini:fim] - y[a])
+                      - (x[a] - x[ini:fim]) * (avg_y - y[a]))
+        a = ini + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def downsample(df: pd.DataFrame, x: str, y: str, n_out: int = MAX_PONTOS) -> pd.DataFrame:
+    """Reduz `df` a no máximo `n_out` linhas preservando a forma de y(x) via LTTB."""
+    d = df.dropna(subset=[x, y])
+    if len(d) <= n_out:
+        return d
+    d = d.sort_values(x)
+    idx = lttb_indices(d[x].to_numpy(dtype=float), d[y].to_numpy(dtype=float), n_out)
+    return d.iloc[idx]
+
+def to_category(df: pd.DataFrame) -> pd.DataFrame:
+    """Colunas de baixa cardinalidade → `category` (comparações/groupby em códigos int)."""
+    cols = [find_col(df, [k]) for k in CATEGORY_KEYS]
+    if "subject" in df and df["subject"].nunique() < 0.5 * len(df):
+        cols.append("subject")
+    for c in filter(None, cols):
+        # via "string": colunas dictionary<> vindas do Parquet não convertem direto
+        df[c] = df[c].astype("string").astype("category")
+    return df
+
+@st.cache_resource
+def get_engine():
+    """Engine/pool únicos, compartilhados entre sessões e reruns."""
+    engine = create_engine(DB_URI, poolclass=QueuePool, pool_size=5,
+                           pool_pre_ping=True, pool_recycle=1800)
+
+    @event.listens_for(engine, "connect")
+    def _json_orjson(dbapi_conn, _):
+        # colunas json já chegam como dict, decodificadas pelo orjson
+        register_default_json(dbapi_conn, loads=_json_loads)
+
+    return engine
+
+@st.cache_data(ttl=timedelta(seconds=30), show_spinner=False)
+def _watermark() -> str:
+    """
+    Versão barata dos dados: muda quando uma análise é criada/atualizada/removida ou quando
+    as threads mudam (novas mensagens, e-mail mais recente) – o frame também traz email_count,
+    assunto, participantes e datas de email_threads.
+    """
+    sql = text("""
+      SELECT (SELECT MAX(COALESCE(updated_at, created_at)) FROM analyses
+               WHERE analysable_type = 'email_thread'),
+             (SELECT COUNT(*) FROM analyses WHERE analysable_type = 'email_thread'),
+             (SELECT MAX(last_email_date) FROM email_threads),
+             (SELECT COALESCE(SUM(message_count), 0) FROM email_threads)
+    """)
+    with get_engine().connect() as conn:
+        ts, n, ultimo_email, n_msgs = conn.execute(sql).one()
+    if not ts:
+        return "vazio"
+    emails = f"{ultimo_email:%Y%m%dT%H%M%S}" if ultimo_email else "0"
+    return f"{ts:%Y%m%dT%H%M%S%f}_{n}_{emails}_{n_msgs}"
+
+def _filtro_sql(estagios: tuple[str, ...] | None) -> str:
+    """Período (e estágios, se houver) aplicados no WHERE – só as linhas pedidas saem do banco."""
+    sql = "AND a.created_at >= :i AND a.created_at < :f"
+    if estagios is not None:
+        sql += f" AND {JSON_FIELDS['extracted_negociacao_estagio']} = ANY(:e)"
+    return sql
+
+def _filtro_params(inicio: date, fim: date, estagios: tuple[str, ...] | None) -> dict:
+    return {"i": inicio, "f": fim + timedelta(days=1), "e": list(estagios or ())}
+
+@st.cache_data(show_spinner=False)
+def read_filter_options(watermark: str) -> tuple[date | None, date | None, list[str]]:
+    """Limites de data e estágios disponíveis, para montar a sidebar sem carregar a tabela."""
+    query = text(f"""
+      SELECT MIN(a.created_at), MAX(a.created_at),
+             array_agg(DISTINCT e.estagio) FILTER (WHERE e.estagio IS NOT NULL)
+        FROM analyses a
+        JOIN email_threads et ON CAST(a.analysable_id AS UUID) = et.id
+        CROSS JOIN LATERAL (SELECT {JSON_FIELDS['extracted_negociacao_estagio']} AS estagio) e
+       WHERE a.analysable_type = 'email_thread'
+         AND et.first_email_date IS NOT NULL AND et.last_email_date IS NOT NULL
+    """)
+    with get_engine().connect() as conn:
+        min_ts, max_ts, estagios = conn.execute(query).one()
+    if min_ts is None:
+        return None, None, []
+    return min_ts.date(), max_ts.date(), sorted(estagios or [])
+
+def read_email_data(inicio: date, fim: date, estagios: tuple[str, ...] | None) -> pd.DataFrame:
+    return _load_email_data(_watermark(), inicio, fim, estagios)
+
+@st.cache_resource(max_entries=8, show_spinner="🔄 Carregando dados do banco…")
+def _load_email_data(watermark: str, inicio: date, fim: date,
+                     estagios: tuple[str, ...] | None) -> pd.DataFrame:
+    """Cache em Parquet por (watermark, filtros): hits quentes pulam SQL e pós-processamento."""
+    chave = hashlib.md5(repr((inicio, fim, estagios)).encode()).hexdigest()[:12]
+    path = os.path.join(PARQUET_DIR, f"vigia_email_{watermark}_{chave}.parquet")
+    if os.path.exists(path):
+        try:
+            df = pd.read_parquet(path, dtype_backend="pyarrow")
+        except Exception:
+            # removido/corrompido por outra sessão: cai no caminho SQL
+            df = None
+        if df is not None:
+            df[DATE_COLUMNS] = df[DATE_COLUMNS].astype("datetime64[ns]")
+            df[FLOAT_COLUMNS] = df[FLOAT_COLUMNS].astype(float)
+            return _index_and_labels(to_category(df))
+
+    df = _query_email_data(inicio, fim, estagios)
+    if not df.empty:
+        # snapshots de watermarks antigos ficam obsoletos; os de outros filtros, não
+        # (várias sessões podem limpar ao mesmo tempo: arquivo já removido não é erro)
+        for old in glob.glob(os.path.join(PARQUET_DIR, "vigia_email_*.parquet")):
+            if not os.path.basename(old).startswith(f"vigia_email_{watermark}_"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(old)
+        # escrita atômica: grava num temporário do mesmo diretório e renomeia,
+        # assim nenhuma sessão lê um Parquet pela metade
+        fd, tmp = tempfile.mkstemp(dir=PARQUET_DIR, prefix="vigia_email_", suffix=".tmp")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp, compression="zstd", index=False)
+            os.replace(tmp, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+    return _index_and_labels(df)
+
+def _index_and_labels(df: pd.DataFrame) -> pd.DataFrame:
+    """Índice string do ID + rótulo do seletor, montados uma vez por snapshot (não a cada rerun)."""
+    if df.empty:
+        return df
+    id_col = get_id_col(df)
+    # índice string → linha: seleção resolvida por hash, sem varrer/converter a coluna
+    df = df.set_index(df[id_col].astype("string").rename("id_str"), drop=False)
+
+    # Tenta extrair um “assunto” (nº do processo) do JSON flat ou da coluna subject
+    subj_col = find_col(df, ["subject", "extracted_numero_processo", "extracted_nome_parte"])
+    if subj_col:
+        assunto = (
+            df[subj_col]
+            .astype("string")  # via string: subject pode vir categórico
+            .fillna("Assunto indisponível")
+            .str.slice(0, 60)  # evita rótulos gigantes
+        )
+    else:
+        # Se nenhuma coluna de assunto for encontrada, usa um padrão
+        assunto = "Assunto indisponível"
+    df[LABEL_COL] = df["created_at"].dt.strftime("%d/%m/%Y %H:%M") + " | " + assunto
+    return df
+
+def _query_email_data(inicio: date, fim: date, estagios: tuple[str, ...] | None) -> pd.DataFrame:
+    json_cols = ",\n             ".join(f"{expr} AS {col}" for col, expr in JSON_FIELDS.items())
+    query = f"""
+      SELECT CAST(a.id AS TEXT) AS analysis_id,
              a.analysable_id,
              et.subject,
              et.participants,
+             -- forma canônica (trim + minúsculas, únicos e ordenados), calculada uma vez
+             ARRAY(SELECT DISTINCT lower(btrim(p))
+                     FROM json_array_elements_text(
+                          CASE WHEN json_typeof(et.participants) = 'array' THEN et.participants END) AS p
+                    WHERE btrim(p) <> ''
+                    ORDER BY 1) AS participants_norm,
              et.first_email_date,
              et.last_email_date,
              (SELECT COUNT(*) FROM email_messages WHERE thread_id = et.id) AS email_count,
              a.created_at,
-             a.extracted_data,
-             a.temperature_assessment,
-             a.director_decision,
-             a.kpis,
-             a.advisor_recommendation,
-             a.context,
-             a.formal_summary
+             {json_cols}
         FROM analyses a
         JOIN email_threads et ON CAST(a.analysable_id AS UUID) = et.id
-       WHERE a.analysable_type = 'email_thread';
+       WHERE a.analysable_type = 'email_thread'
+         {_filtro_sql(estagios)};
     """
-    with engine.connect() as conn:
-        df = pd.read_sql(query, conn)
+    # cursor server-side (psycopg2 named cursor) + colunas Arrow, sem objetos str
+    engine = get_engine().execution_options(stream_results=True, yield_per=5000)
+    df = pd.read_sql(text(query), engine, dtype_backend="pyarrow",
+                     params=_filtro_params(inicio, fim, estagios))
 
     if df.empty:
         return df
 
     # Datas & tempo de resolução
-    for c in ["created_at", "first_email_date", "last_email_date"]:
-        df[c] = pd.to_datetime(df[c], errors="coerce")
-    df.dropna(subset=["first_email_date", "last_email_date"], inplace=True)
-    df["tempo_resolucao_dias"] = (
-        (df["last_email_date"] - df["first_email_date"]).dt.total_seconds() / 86_400
-    ).round(1)
-
-    # Parse/flatten JSON
-    df_proc = df.copy()
-    def _safe(x):
-        if isinstance(x, dict):
-            return x
-        if isinstance(x, str) and x.strip():
-            try:
-                return json.loads(x)
-            except json.JSONDecodeError:
-                return {}
-        return {}
-    for col in JSON_COLUMNS:
-        if col not in df_proc:
-            continue
-        nested = df_proc[col].apply(_safe).tolist()
-        flat = pd.json_normalize(nested, sep="_").set_index(df_proc.index)
-        prefix_map = {
-            "extracted_data": "extracted",
-            "temperature_assessment": "temperature",
-            "director_decision": "director",
-            "context": "pipedrive",
-            "advisor_recommendation": "advisor",
-            "formal_summary": "summary"
-        }
-        prefix = prefix_map.get(col, col.split('_')[0])
-        flat.columns = [f"{prefix}_{c}" for c in flat.columns]
-        
-        df_proc = df_proc.join(flat)
-
-    df_proc.drop(columns=JSON_COLUMNS, inplace=True, errors="ignore")
-
-    # Valor da proposta
-    df_proc["valor_proposta"] = np.nan
-    for c in [c for c in df_proc.columns if "proposta_valor" in c]:
-        s = df_proc[c].astype(str).str.extract(r"(\d[\d.,]*)")[0]
-        pat_thou = r"(?<=\d)[.,](?=\d{3}(?:\D|$))"
-        nums = (
-            s.str.replace(r"[^\d,.-]", "", regex=True)
-             .str.replace(pat_thou, "", regex=True)
-             .str.replace(",", ".")
-             .astype(float)
-        )
-        df_proc["valor_proposta"].fillna(nums, inplace=True)
+    # TIMESTAMP já chega como timestamp Arrow → um único cast p/ datetime64 NumPy
+    df[DATE_COLUMNS] = df[DATE_COLUMNS].astype("datetime64[ns]")
+    df = df.dropna(subset=["first_email_date", "last_email_date"])
+    # diferença em segundos inteiros (int64 puro no NumPy)
+    segundos = np.subtract(df["last_email_date"].to_numpy(dtype="datetime64[s]"),
+                           df["first_email_date"].to_numpy(dtype="datetime64[s]")).astype(np.int64)
+    df["tempo_resolucao_dias"] = np.round(segundos / 86_400, 1)
+
+    # Valor da proposta (1º candidato *parseável* por linha)
+    cands = [c for c in df.columns if "proposta_valor" in c]
+    if cands:
+        parsed = pd.DataFrame({c: parse_moeda(df[c]) for c in cands}, index=df.index)
+        df["valor_proposta"] = parsed.bfill(axis=1).iloc[:, 0]
+    else:
+        df["valor_proposta"] = np.nan
 
-    return df_proc
+    return to_category(df)
+
+# Mesmo parse de moeda de RE_VALOR/RE_SEP_MILHAR, em SQL (NULL se não numérico)
+_VALOR_NUM_SQL = r"""
+  replace(regexp_replace(substring({expr} from '\d[\d.,]*'),
+                         '(?<=\d)[.,](?=\d{{3}}(\D|$))', '', 'g'), ',', '.')
+"""
+
+@st.cache_data(ttl=timedelta(minutes=5), show_spinner=False)
+def read_weekly_agg(inicio: date, fim: date, estagios: tuple[str, ...] | None) -> pd.DataFrame:
+    """Threads e valor proposto por semana, agregados no PostgreSQL."""
+    valor_num = _VALOR_NUM_SQL.format(expr=JSON_FIELDS["extracted_proposta_valor"])
+    query = text(f"""
+      SELECT date_trunc('week', a.created_at) AS created_at,
+             COUNT(DISTINCT a.analysable_id) AS threads,
+             CAST(SUM(CASE WHEN v.num ~ '^\\d+(\\.\\d+)?$' THEN v.num::numeric END) AS float) AS valor
+        FROM analyses a
+        JOIN email_threads et ON CAST(a.analysable_id AS UUID) = et.id
+        CROSS JOIN LATERAL (SELECT {valor_num} AS num) v
+       WHERE a.analysable_type = 'email_thread'
+         AND et.first_email_date IS NOT NULL AND et.last_email_date IS NOT NULL
+         {_filtro_sql(estagios)}
+       GROUP BY 1
+       ORDER BY 1
+    """)
+    return pd.read_sql(query, get_engine(), params=_filtro_params(inicio, fim, estagios))
+
+@st.cache_data(ttl=timedelta(minutes=5), show_spinner=False)
+def read_argumentos_legais(inicio: date, fim: date, estagios: tuple[str, ...] | None) -> str:
+    """Texto da word-cloud, buscado à parte: o frame principal não carrega texto livre."""
+    query = text(f"""
+      SELECT string_agg(arg, ' ')
+        FROM analyses a
+        JOIN email_threads et ON CAST(a.analysable_id AS UUID) = et.id
+        CROSS JOIN LATERAL json_array_elements_text(
+             CASE WHEN json_typeof(a.extracted_data->'argumentos_legais') = 'array'
+                  THEN a.extracted_data->'argumentos_legais' END) AS arg
+       WHERE a.analysable_type = 'email_thread'
+         AND et.first_email_date IS NOT NULL AND et.last_email_date IS NOT NULL
+         {_filtro_sql(estagios)}
+    """)
+    with get_engine().connect() as conn:
+        return conn.execute(query, _filtro_params(inicio, fim, estagios)).scalar() or ""
+
+@st.cache_data(ttl=timedelta(minutes=5), show_spinner=False)
+def read_email_json(analysis_id: str) -> dict:
+    """Busca sob demanda os blobs JSON brutos de uma única análise."""
+    query = text(f"SELECT {', '.join(JSON_COLUMNS)} FROM analyses WHERE id = CAST(:id AS UUID)")
+    with get_engine().connect() as conn:
+        row = conn.execute(query, {"id": analysis_id}).mappings().first()
+    return dict(row) if row else {}
 
 # --------------------------------------------------------------------------
 # ABA 1 – RESUMOS
 # --------------------------------------------------------------------------
-def tab_resumos(df: pd.DataFrame):
+def tab_resumos(df: pd.DataFrame, ts: pd.DataFrame):
     st.subheader("📊 KPIs & Métricas Financeiras")
 
     total_threads = df["analysable_id"].nunique()
@@ -172,9 +429,10 @@ def tab_resumos(df: pd.DataFrame):
     total_valor   = valor_cols.sum()
     ticket_medio  = valor_cols.mean()
 
-    fechados      = df[estatus].eq("Acordo Fechado").sum() if estatus else 0
+    fechado_mask  = df[estatus].isin(["Acordo Fechado"]) if estatus else []
+    fechados      = fechado_mask.sum() if estatus else 0
     taxa_fech     = 100 * fechados / total_threads if total_threads else 0
-    valor_fech    = df.loc[df[estatus].eq("Acordo Fechado") if estatus else [], "valor_proposta"].sum()
+    valor_fech    = df.loc[fechado_mask, "valor_proposta"].sum()
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Threads analisadas",           total_threads)
@@ -189,12 +447,6 @@ def tab_resumos(df: pd.DataFrame):
 
     st.divider()
     st.subheader("📈 Evolução semanal de threads & valor")
-    ts = (df.set_index("created_at")
-            .resample("W-MON")
-            .agg(threads=("analysable_id", "nunique"),
-                 valor=("valor_proposta", "sum"))
-            .reset_index())
-
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(go.Bar(x=ts.created_at, y=ts.threads, name="Threads", marker_color="#1f77b4"), secondary_y=False)
     fig.add_trace(go.Scatter(x=ts.created_at, y=ts.valor,   name="Valor (R$)", mode="lines+markers", marker_color="#ff7f0e"), secondary_y=True)
@@ -206,7 +458,33 @@ def tab_resumos(df: pd.DataFrame):
 # --------------------------------------------------------------------------
 # ABA 2 – ANÁLISES
 # --------------------------------------------------------------------------
-def tab_analises(df: pd.DataFrame):
+@st.cache_data(show_spinner=False)
+def compute_layout(edges: tuple[tuple[str, str], ...]) -> dict:
+    """Fruchterman–Reingold determinístico (seed fixa) → cacheável pelas arestas."""
+    G = nx.Graph()
+    G.add_edges_from(edges)
+    return nx.spring_layout(G, k=0.4, seed=42)
+
+@st.cache_data(show_spinner=False)
+def build_wordcloud(text: str) -> np.ndarray:
+    return WordCloud(width=600, height=300, background_color="white").generate(text).to_array()
+
+@st.cache_data(show_spinner=False)
+def fit_logit(log_df: pd.DataFrame, xs: np.ndarray):
+    """Logit y ~ e-mails + tempo; devolve o summary e a curva P(fechar) em `xs`."""
+    logit = smf.logit("y ~ email_count + tempo_resolucao_dias", data=log_df).fit(disp=False)
+    ts_ = np.linspace(0, log_df.tempo_resolucao_dias.max(), 100)
+    df_grid = pd.DataFrame({"email_count": xs, "tempo_resolucao_dias": np.median(ts_)})
+    return logit.summary(), np.asarray(logit.predict(df_grid))
+
+@st.cache_data(show_spinner=False)
+def fit_km(duracoes: np.ndarray, eventos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Kaplan-Meier → (tempos, S(t)) em arrays: valor de cache pequeno e picklable."""
+    kmf = KaplanMeierFitter().fit(duracoes, event_observed=eventos)
+    sf = kmf.survival_function_
+    return sf.index.to_numpy(), sf["KM_estimate"].to_numpy()
+
+def tab_analises(df: pd.DataFrame, ts: pd.DataFrame, filtros: tuple):
     st.subheader("🔍 Análises Estatísticas & Visuais")
 
     eng_col   = find_col(df, ["temperature_engajamento"])
@@ -218,7 +496,7 @@ def tab_analises(df: pd.DataFrame):
     # 1. Scatter Engajamento × Urgência
     if eng_col and urg_col:
         st.markdown("#### Engajamento × Urgência")
-        sc_df = df.copy()
+        sc_df = downsample(df, eng_col, urg_col)
         sc_df["subject_short"] = sc_df["subject"].apply(lambda s: wrap_text(s, 120))
         fig_sc = px.scatter(
             sc_df, x=eng_col, y=urg_col,
@@ -273,18 +551,29 @@ def tab_analises(df: pd.DataFrame):
     num_cols = [c for c in ["email_count", "tempo_resolucao_dias", "valor_proposta"] if c in df]
     if len(num_cols) >= 3:
         st.markdown("#### Scatter matrix (KPIs)")
-        fig_pair = px.scatter_matrix(
-            df[num_cols].dropna(), dimensions=num_cols, template=PLOTLY_TEMPLATE)
-        fig_pair.update_traces(diagonal_visible=False, showupperhalf=False)
+        pair_df = df[num_cols].dropna()
+        n = len(num_cols)
+        # só o triângulo inferior: evita enviar ao browser painéis ocultos
+        fig_pair = make_subplots(rows=n, cols=n, shared_xaxes=True, shared_yaxes=True)
+        for i, ci in enumerate(num_cols):
+            for j, cj in enumerate(num_cols[:i]):
+                pts = downsample(pair_df, cj, ci)
+                fig_pair.add_trace(
+                    go.Scattergl(x=pts[cj], y=pts[ci], mode="markers",
+                                 marker=dict(size=4), showlegend=False),
+                    row=i + 1, col=j + 1)
+            fig_pair.update_yaxes(title_text=ci, row=i + 1, col=1)
+            fig_pair.update_xaxes(title_text=ci, row=n, col=i + 1)
+        fig_pair.update_layout(template=PLOTLY_TEMPLATE)
         st.plotly_chart(fig_pair, use_container_width=True)
 
     st.divider()
 
     # 6. Volume semanal
     st.markdown("#### Volume semanal de threads")
-    ts = df.set_index("created_at").resample("W")["analysable_id"].nunique()
-    fig_vol = px.bar(ts, labels={"value": "Threads", "created_at": "Semana"},
-                       template=PLOTLY_TEMPLATE)
+    fig_vol = px.bar(ts, x="created_at", y="threads",
+                     labels={"threads": "Threads", "created_at": "Semana"},
+                     template=PLOTLY_TEMPLATE)
     st.plotly_chart(fig_vol, use_container_width=True)
     
     st.divider()
@@ -299,14 +588,11 @@ def tab_analises(df: pd.DataFrame):
         log_df["y"] = log_df[stat_col].eq("Acordo Fechado").astype(int)
         if log_df["y"].nunique() == 2 and len(log_df) > 20:
             try:
-                logit = smf.logit("y ~ email_count + tempo_resolucao_dias", data=log_df).fit(disp=False)
-                st.write(logit.summary())
-                # curva de resposta
                 xs = np.linspace(0, log_df.email_count.max(), 100)
-                ts_ = np.linspace(0, log_df.tempo_resolucao_dias.max(), 100)
-                df_grid = pd.DataFrame({"email_count": xs,
-                                        "tempo_resolucao_dias": np.median(ts_)})
-                probs = logit.predict(df_grid)
+                summary, probs = fit_logit(
+                    log_df[["y", "email_count", "tempo_resolucao_dias"]].astype(float), xs)
+                st.write(summary)
+                # curva de resposta
                 fig_log = go.Figure([
                     go.Scatter(x=xs, y=probs, mode="lines", name="Prob. fechar"),
                     go.Scatter(x=log_df.email_count, y=log_df.y+0.02, mode="markers",
@@ -325,27 +611,28 @@ def tab_analises(df: pd.DataFrame):
         km_df = df[["tempo_resolucao_dias", stat_col]].dropna()
         km_df["fechou"] = km_df[stat_col].eq("Acordo Fechado").astype(int)
         if km_df["fechou"].sum():
-            kmf = KaplanMeierFitter()
-            kmf.fit(km_df["tempo_resolucao_dias"], event_observed=km_df["fechou"])
-            fig_surv = go.Figure(go.Scatter(
-                x=kmf.survival_function_.index,
-                y=kmf.survival_function_["KM_estimate"],
-                mode="lines"))
+            km_x, km_y = fit_km(km_df["tempo_resolucao_dias"].to_numpy(dtype=float),
+                                km_df["fechou"].to_numpy())
+            fig_surv = go.Figure(go.Scatter(x=km_x, y=km_y, mode="lines"))
             fig_surv.update_layout(template=PLOTLY_TEMPLATE,
                                    xaxis_title="Dias", yaxis_title="P(NÃO fechado)")
             st.plotly_chart(fig_surv, use_container_width=True)
 
     # 8. Rede de participantes
-    if nx and "participants" in df.columns:
+    if nx and "participants_norm" in df.columns:
         with st.expander("🔗 Rede de participantes"):
-            edges = []
-            for parts in df["participants"].dropna():
-                ps = list({p.strip().lower() for p in parts})
-                edges += list(itertools.combinations(ps, 2))
+            # incidência thread × participante → co-ocorrência (Bᵀ·B) em C, sem combinations()
+            parts = df["participants_norm"].explode().dropna()
+            pares = pd.DataFrame({"t": parts.index, "p": parts.to_numpy()})
+            t_codes, _ = pd.factorize(pares["t"])
+            p_codes, nomes = pd.factorize(pares["p"])
+            B = sparse.csr_matrix((np.ones(len(pares), dtype=np.int32), (t_codes, p_codes)))
+            A = sparse.triu(B.T @ B, k=1).tocoo()
+            nomes = np.asarray(nomes, dtype=object)
             G = nx.Graph()
-            G.add_edges_from(edges)
+            G.add_edges_from(zip(nomes[A.row], nomes[A.col]))
             if G.number_of_nodes() > 2:
-                pos = nx.spring_layout(G, k=0.4, seed=42)
+                pos = compute_layout(tuple(G.edges()))
                 edge_x, edge_y = [], []
                 for e in G.edges():
                     x0, y0 = pos[e[0]]
@@ -357,7 +644,7 @@ def tab_analises(df: pd.DataFrame):
                     go.Scatter(x=edge_x, y=edge_y, mode="lines",
                                line=dict(width=0.5), hoverinfo="none"),
                     go.Scatter(x=node_x, y=node_y, mode="markers+text",
-                               text=list(G.nodes()), textposition="top center",
+                               text=list(pos), textposition="top center",
                                marker=dict(size=6))])
                 fig_net.update_layout(template=PLOTLY_TEMPLATE,
                                       showlegend=False, height=500)
@@ -366,12 +653,11 @@ def tab_analises(df: pd.DataFrame):
                 st.info("Rede muito pequena para visualização.")
 
     # 9. Word‑cloud de argumentos legais
-    if WordCloud and "argumentos_legais" in df.columns:
+    if WordCloud:
         with st.expander("☁️ Word‑cloud de argumentos legais"):
-            text = " ".join(itertools.chain.from_iterable(df["argumentos_legais"].dropna()))
-            if text.strip():
-                wc = WordCloud(width=600, height=300, background_color="white").generate(text)
-                st.image(wc.to_array(), use_column_width=True)
+            texto = read_argumentos_legais(*filtros)
+            if texto.strip():
+                st.image(build_wordcloud(texto), use_column_width=True)
             else:
                 st.info("Nenhum argumento legal encontrado.")
 
@@ -382,38 +668,58 @@ def tab_tabelas(df: pd.DataFrame):
     st.subheader("📑 Tabela Detalhada & Sumarizações")
 
     # ---------- seletor de colunas ----------
-    cols_all = sorted(df.columns)
+    cols_all = sorted(c for c in df.columns if c != LABEL_COL)
     default_cols = ["subject","email_count","tempo_resolucao_dias",
                     "valor_proposta", find_col(df,["status_acordo"]),
                     find_col(df,["negociacao_estagio"])]
     selected = st.multiselect("Colunas a exibir", cols_all,
                               default=[c for c in default_cols if c in cols_all])
 
-    # ---------- data editor ----------
-    df_show = df[selected].copy()
-    df_show.rename(columns=lambda c: c.replace("_"," ").title(), inplace=True)
-    st.data_editor(
-        df_show,
-        use_container_width=True,
-        hide_index=True,
-        num_rows="dynamic"
-    )
+    # ---------- tabela (editor só sob demanda) ----------
+    df_show = df[selected].rename(columns=lambda c: c.replace("_"," ").title())
+    col_cfg = {"Valor Proposta": MOEDA_COL}
+    if st.toggle("Modo edição", value=False):
+        # edições não são persistidas: editor pesado só numa amostra
+        n = len(df_show)
+        amostra = n if n <= 100 else st.slider("Amostra", 100, n, min(500, n))
+        st.data_editor(
+            df_show.head(amostra),
+            use_container_width=True,
+            hide_index=True,
+            num_rows="dynamic",
+            column_config=col_cfg,
+        )
+    else:
+        st.dataframe(df_show, use_container_width=True, hide_index=True,
+                     column_config=col_cfg)
 
     # ---------- resumo por estágio ----------
     est_col = find_col(df, ["negociacao_estagio"])
     if est_col and "valor_proposta" in df:
         st.markdown("#### Resumo financeiro por estágio")
-        resumo = (df.groupby(est_col)
-                    .agg(threads=("analysable_id","nunique"),
-                         valor_total=("valor_proposta","sum"),
-                         ticket_medio=("valor_proposta","mean"))
-                    .sort_values("threads", ascending=False))
-        resumo.rename(columns={"threads":"Threads",
-                               "valor_total":"Valor Total (R$)",
-                               "ticket_medio":"Ticket Médio (R$)"}, inplace=True)
-        st.dataframe(resumo.style.format({"Valor Total (R$)":"R$ {:.2f}",
-                                          "Ticket Médio (R$)":"R$ {:.2f}"}),
-                       use_container_width=True)
+        est = df[est_col].astype("category")  # no-op se já veio categórico
+        grp = df.groupby(est, observed=True)["valor_proposta"]
+        resumo = pd.DataFrame({
+            "valor_total": grp.sum(**NUMBA_ENGINE),
+            "ticket_medio": grp.mean(**NUMBA_ENGINE),
+        })
+        # nunique por estágio via pares únicos (estágio × thread) em int64
+        codes_g = est.cat.codes.to_numpy()
+        codes_id, _ = pd.factorize(df["analysable_id"])
+        ok = (codes_g >= 0) & (codes_id >= 0)
+        n_ids = int(codes_id.max()) + 1 if ok.any() else 1
+        pares = np.unique(codes_g[ok].astype(np.int64) * n_ids + codes_id[ok])
+        threads = np.bincount(pares // n_ids, minlength=len(est.cat.categories))
+        resumo.insert(0, "threads", pd.Series(threads, index=est.cat.categories)
+                                      .reindex(resumo.index).to_numpy())
+        resumo = resumo.sort_values("threads", ascending=False)
+        resumo = resumo.rename(columns={"threads":"Threads",
+                                        "valor_total":"Valor Total (R$)",
+                                        "ticket_medio":"Ticket Médio (R$)"})
+        # formatação no cliente (sem Styler/Jinja gerando HTML por célula)
+        st.dataframe(resumo, use_container_width=True,
+                     column_config={c: MOEDA_COL for c in ("Valor Total (R$)",
+                                                           "Ticket Médio (R$)")})
 
 # --------------------------------------------------------------------------
 # ABA 4 – ANÁLISE INDIVIDUAL (E-mail)
@@ -424,7 +730,7 @@ def get_id_col(df: pd.DataFrame) -> str:
             return cand
     raise KeyError("Nenhuma coluna de ID encontrada (analysis_id / id).")
 
-def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> None:
+def tab_email_individual(df_filtered: pd.DataFrame) -> None:
     """
     🔎 Exibe uma thread de e-mail específica com seus blobs JSON
     (extracted_data, temperature_assessment, director_decision).
@@ -443,35 +749,13 @@ def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> Non
     # ──────────────────────────────────────────────────────────────
     # 1) <selectbox> – sempre strings
     # ──────────────────────────────────────────────────────────────
-    id_col = get_id_col(df_filtered)
-    df_view = df_filtered.copy()
-    df_view["id_str"] = df_view[id_col].astype(str)
-
-    # Tenta extrair um “assunto” (nº do processo) do JSON flat ou da coluna subject
-    subj_col = find_col(df_view, ["subject", "extracted_numero_processo", "extracted_nome_parte"])
-
-    if subj_col:
-        df_view["assunto"] = (
-            df_view[subj_col]
-            .fillna("Assunto indisponível")
-            .astype(str)
-            .str.slice(0, 60)  # evita rótulos gigantes
-        )
-    else:
-        # Se nenhuma coluna de assunto for encontrada, cria uma padrão
-        df_view["assunto"] = "Assunto indisponível"
-
-
-    labels = (
-        df_view["created_at"].dt.strftime("%d/%m/%Y %H:%M")
-        + " | "
-        + df_view["assunto"]
-    )
-    labels.index = df_view["id_str"]
+    # índice string e rótulos já vêm prontos do cache (_index_and_labels)
+    df_view = df_filtered
+    labels = df_view[LABEL_COL]
 
     sel = st.selectbox(
         "Selecione uma thread:",
-        options=df_view["id_str"],
+        options=df_view.index,
         format_func=lambda k: labels.get(k, "ID não encontrado"),
     )
     if not sel:
@@ -480,11 +764,12 @@ def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> Non
     # ──────────────────────────────────────────────────────────────
     # 2) Linha completa
     # ──────────────────────────────────────────────────────────────
-    row = df_raw.loc[df_raw[id_col].astype(str) == sel].iloc[0]
+    row = df_view.loc[sel]
+    blobs = read_email_json(sel)
     st.divider()
 
     # ──────────────────────────────────────────────────────────────
-    # 3) Helper JSON (aceita flatten)
+    # 3) Helper JSON (blob bruto, sob demanda; senão colunas flat)
     # ──────────────────────────────────────────────────────────────
     def _json_email(prefix: str) -> dict | None:
         raw_key = {
@@ -498,13 +783,16 @@ def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> Non
         }[prefix]
 
         # 3a) blob bruto existe?
-        if raw_key in row and isinstance(row[raw_key], str) and row[raw_key].strip():
+        raw = blobs.get(raw_key)
+        if isinstance(raw, dict) and raw:
+            return raw
+        if isinstance(raw, str) and raw.strip():
             try:
-                return json.loads(row[raw_key])
+                return json.loads(raw)
             except json.JSONDecodeError:
-                return {"erro": "JSON inválido", "raw_data": row[raw_key]}
+                return {"erro": "JSON inválido", "raw_data": raw}
 
-        # 3b) reconstruir do flatten
+        # 3b) reconstruir das colunas projetadas
         subcols = {c: row[c] for c in row.index if c.startswith(f"{prefix}_")}
         if not subcols:
             return None
@@ -512,7 +800,7 @@ def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> Non
         rebuilt = {
             c.split(f"{prefix}_", 1)[1]: v
             for c, v in subcols.items()
-            if not (np.isscalar(v) and pd.isna(v))
+            if not (pd.api.types.is_scalar(v) and pd.isna(v))
         }
         return rebuilt or None
 
@@ -591,42 +879,40 @@ def tab_email_individual(df_raw: pd.DataFrame, df_filtered: pd.DataFrame) -> Non
 def main():
     st.title("📧 Dashboard de Negociações por E‑mail")
 
-    df_raw = read_email_data()
-    if df_raw.empty:
+    min_d, max_d, est_opts = read_filter_options(_watermark())
+    if min_d is None:
         st.warning("⚠️ Nenhum dado encontrado no banco.")
         return
 
-    # -------- filtros laterais --------
+    # -------- filtros laterais (aplicados no SQL) --------
     st.sidebar.header("⚙️ Filtros")
-    min_d, max_d = df_raw.created_at.min().date(), df_raw.created_at.max().date()
     inicio, fim = st.sidebar.date_input("Período", (min_d, max_d),
                                         min_value=min_d, max_value=max_d)
     if inicio > fim:
         st.sidebar.error("Datas inválidas.")
         return
-    df = df_raw[(df_raw.created_at.dt.date >= inicio) &
-                (df_raw.created_at.dt.date <= fim)].copy()
 
-    est_col = find_col(df, ["negociacao_estagio"])
-    if est_col:
-        est_opts = sorted(df[est_col].dropna().unique())
+    estagios = None
+    if est_opts:
         escolha = st.sidebar.multiselect("Filtrar por estágio", est_opts, default=est_opts)
-        df = df[df[est_col].isin(escolha)]
+        estagios = tuple(escolha)
 
+    df = read_email_data(inicio, fim, estagios)
     if df.empty:
         st.info("Nenhum registro para os filtros escolhidos.")
         return
 
     # -------- abas --------
     abas = st.tabs(["📊 Resumos", "🔍 Análises", "📑 Tabelas", " 🔎 E-mail Individual "])
+    ts = read_weekly_agg(inicio, fim, estagios)
     with abas[0]: 
-        tab_resumos(df)
+        tab_resumos(df, ts)
     with abas[1]: 
-        tab_analises(df)
+        tab_analises(df, ts, (inicio, fim, estagios))
     with abas[2]: 
         tab_tabelas(df)
     with abas[3]:
-        tab_email_individual(df_raw, df) 
+        tab_email_individual(df) 
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
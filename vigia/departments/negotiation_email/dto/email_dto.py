@@ -2,6 +2,7 @@
 
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property
 from typing import List, Optional
 
 @dataclass(frozen=True)
@@ -23,4 +24,13 @@ class EmailDTO:
     from_address: str
     to_addresses: List[str]
     has_attachments: bool
-    importance: Optional[str]
\ No newline at end of file
+    importance: Optional[str]
+
+    # Visões minúsculas memoizadas (cached_property grava direto no __dict__, ok com frozen)
+    @cached_property
+    def subject_lc(self) -> str:
+        return (self.subject or "").lower()
+
+    @cached_property
+    def recipients_lc(self) -> str:
+        return " ".join(self.to_addresses or []).lower()
\ No newline at end of file
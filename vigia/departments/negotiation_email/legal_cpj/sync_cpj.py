@@ -39,37 +39,44 @@ async def main() -> Optional[int]:
     db: Session = SessionLocal()
 
     try:
-        processos_do_cpj = cpj_service.get_latest_updated_cpj_processes(
-            limit=args.limit
-        )
-
-        if not processos_do_cpj:
-            logging.info("Nenhum processo novo ou atualizado encontrado no CPJ.")
-            return 0
-
-        enriquecidos_count = 0
-        for cpj_data in processos_do_cpj:
-            legal_process = cpj_service.sync_process_from_cpj(
-                db=db, user_id=args.user_id, cpj_data=cpj_data
+        # Fase 1: uma única conexão do CPJ para a descoberta e a sincronização do lote.
+        # Ela é devolvida ao pool antes do enriquecimento, que aguarda o Jus.br por rede.
+        process_numbers = []
+        with cpj_service.cpj_engine.connect() as cpj_conn:
+            processos_do_cpj = cpj_service.get_latest_updated_cpj_processes(
+                limit=args.limit, conn=cpj_conn
             )
 
-            if not legal_process or not legal_process.process_number:
-                logging.warning(
-                    "Processo do CPJ não pôde ser sincronizado ou não possui um número válido. Pulando enriquecimento."
+            if not processos_do_cpj:
+                logging.info("Nenhum processo novo ou atualizado encontrado no CPJ.")
+                return 0
+
+            for cpj_data in processos_do_cpj:
+                legal_process = cpj_service.sync_process_from_cpj(
+                    db=db, user_id=args.user_id, cpj_data=cpj_data, cpj_conn=cpj_conn
                 )
-                continue
 
+                if not legal_process or not legal_process.process_number:
+                    logging.warning(
+                        "Processo do CPJ não pôde ser sincronizado ou não possui um número válido. Pulando enriquecimento."
+                    )
+                    continue
+                process_numbers.append(legal_process.process_number)
+
+        # Fase 2: enriquecimento via Jus.br, já sem conexão/transação do CPJ aberta
+        enriquecidos_count = 0
+        for process_number in process_numbers:
             try:
                 logging.info(
-                    f"Processo {legal_process.process_number} sincronizado do CPJ. Buscando detalhes completos no Jus.br..."
+                    f"Processo {process_number} sincronizado do CPJ. Buscando detalhes completos no Jus.br..."
                 )
                 jusbr_data_list = await jusbr_service.get_processo_details_with_docs(
-                    legal_process.process_number
+                    process_number
                 )
 
                 if not jusbr_data_list or jusbr_data_list[0].get("erro"):
                     logging.warning(
-                        f"Não foram encontrados dados no Jus.br para o processo {legal_process.process_number}. Detalhe: {jusbr_data_list[0].get('erro', 'Resposta vazia')}"
+                        f"Não foram encontrados dados no Jus.br para o processo {process_number}. Detalhe: {(jusbr_data_list or [{}])[0].get('erro', 'Resposta vazia')}"
                     )
                     continue
 
@@ -79,12 +86,12 @@ async def main() -> Optional[int]:
                     )
 
                 logging.info(
-                    f"Processo {legal_process.process_number} enriquecido com sucesso via Jus.br."
+                    f"Processo {process_number} enriquecido com sucesso via Jus.br."
                 )
                 enriquecidos_count += 1
             except Exception as e:
                 logging.error(
-                    f"Falha ao enriquecer o processo {legal_process.process_number} via Jus.br: {e}",
+                    f"Falha ao enriquecer o processo {process_number} via Jus.br: {e}",
                     exc_info=True,
                 )
 
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List
 from ..dto.email_dto import EmailDTO
 
 class EmailRepositoryPort(ABC):
@@ -10,4 +10,19 @@ class EmailRepositoryPort(ABC):
         Salva uma lista de DTOs de e-mail no banco de dados.
         Retorna o número de registros salvos/atualizados.
         """
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def get_message_counts(self, conversation_ids: List[str]) -> Dict[str, int]:
+        """
+        Retorna o message_count armazenado por conversation_id (threads inexistentes ficam de fora).
+        """
+        pass
+
+    @abstractmethod
+    def backfill_message_counts(self) -> int:
+        """
+        Preenche message_count das threads que ainda estão zeradas mas têm mensagens.
+        Retorna o número de threads atualizadas.
+        """
+        pass
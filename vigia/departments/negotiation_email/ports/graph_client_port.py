@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, Iterator, List, Optional
 from ..dto.email_dto import EmailDTO, FolderDTO
 
 class GraphClientPort(ABC):
@@ -13,11 +13,18 @@ class GraphClientPort(ABC):
         pass
 
     @abstractmethod
-    def fetch_messages_in_folder(self, account_email: str, folder_id: str) -> List[EmailDTO]:
-        """Busca todas as mensagens dentro de uma pasta específica."""
+    def fetch_messages_in_folder(
+        self, account_email: str, folder_id: str, odata_filter: Optional[str] = None
+    ) -> Iterator[EmailDTO]:
+        """Itera as mensagens de uma pasta página a página (opcionalmente filtradas no servidor via $filter)."""
         pass
 
     @abstractmethod
     def fetch_conversation_thread(self, account_email: str, conversation_id: str) -> List[EmailDTO]:
         """Busca todas as mensagens de uma thread de conversa específica."""
+        pass
+
+    @abstractmethod
+    def fetch_conversation_counts(self, account_email: str, conversation_ids: List[str]) -> Dict[str, int]:
+        """Nº de mensagens por conversa; conversas cuja contagem falhar ficam fora do dict."""
         pass
\ No newline at end of file
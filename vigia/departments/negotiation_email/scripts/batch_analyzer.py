@@ -3,14 +3,39 @@ import logging
 import asyncio
 import traceback
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import select
 
 from db.session import SessionLocal
 from db import models 
 from vigia.departments.negotiation_email.core.orchestrator import run_department_pipeline
+from vigia.departments.negotiation_email.adapters.email_repository import PostgresEmailRepository
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _select_threads(db: Session, strategy: str, limit: int) -> list[str]:
+    if strategy == 'longest':
+        # Threads com mais mensagens (coluna materializada e indexada)
+        stmt = (
+            select(models.EmailThread.conversation_id)
+            .order_by(models.EmailThread.message_count.desc())
+            .limit(limit)
+        )
+    else:  # latest
+        # Query para encontrar as threads com a última mensagem mais recente
+        stmt = (
+            select(models.EmailThread.conversation_id)
+            .order_by(models.EmailThread.last_email_date.desc())
+            .limit(limit)
+        )
+    return list(db.execute(stmt).scalars().all())
+
+def _select_threads_sync(strategy: str, limit: int) -> list[str]:
+    db: Session = SessionLocal()
+    try:
+        return _select_threads(db, strategy, limit)
+    finally:
+        db.close()
+
 async def main_async():
     """
     Script para analisar um lote de threads de e-mail do banco de dados.
@@ -26,30 +51,15 @@ async def main_async():
     args = parser.parse_args()
 
     logging.info(f"Iniciando análise em lote de {args.limit} threads usando a estratégia '{args.strategy}'.")
-    db: Session = SessionLocal()
     threads_to_analyze = []
     
     try:
         if args.strategy == 'longest':
-            # Query para encontrar as threads com mais mensagens
-            query_result = (
-                db.query(models.EmailThread.conversation_id)
-                .join(models.EmailMessage)
-                .group_by(models.EmailThread.conversation_id)
-                .order_by(func.count(models.EmailMessage.id).desc())
-                .limit(args.limit)
-                .all()
-            )
-        else:  # latest
-            # Query para encontrar as threads com a última mensagem mais recente
-            query_result = (
-                db.query(models.EmailThread.conversation_id)
-                .order_by(models.EmailThread.last_email_date.desc())
-                .limit(args.limit)
-                .all()
-            )
-        
-        threads_to_analyze = [row[0] for row in query_result]
+            # message_count de threads antigas pode estar zerado; preenche antes de ordenar
+            await asyncio.to_thread(PostgresEmailRepository().backfill_message_counts)
+
+        # Session síncrona fora do event loop (cada pipeline abre a sua em thread)
+        threads_to_analyze = await asyncio.to_thread(_select_threads_sync, args.strategy, args.limit)
 
         if not threads_to_analyze:
             logging.warning("Nenhuma thread de e-mail encontrada para analisar.")
@@ -73,8 +83,6 @@ async def main_async():
                 
     except Exception as e:
         logging.error(f"Ocorreu um erro crítico durante a análise em lote: {e}", exc_info=True)
-    finally:
-        db.close()
     
     logging.info("Análise em lote de e-mails concluída. ✅")
 
@@ -1,75 +1,123 @@
 import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, select, update
 from db import models
 from db.session import SessionLocal
-from vigia.departments.negotiation_email.services.discord_notifier import create_update_embed, send_discord_notification
-from vigia.services import crud, jusbr_service
+from vigia.config import settings
+from vigia.departments.negotiation_email.services.discord_notifier import aclose_client, create_update_embed, send_discord_notification
+from vigia.services import crud
+from vigia.services.jusbr_service import jusbr_service
+
+_EMPTY: frozenset = frozenset()
+
+async def _fetch_latest(number: str, sem: asyncio.Semaphore):
+    """Consulta o Jus.br para um processo (limitado pelo semáforo); erros viram resultado."""
+    async with sem:
+        try:
+            # lista com uma entrada por instância/incidência (ou [{'erro': ...}])
+            return number, await jusbr_service.get_processo_details_with_docs(number)
+        except Exception as e:
+            return number, e
 
 async def sync_all_processes():
     print("Iniciando a sincronização de processos...")
     db = SessionLocal()
     try:
-        # 1. Pega todos os grupos de processos distintos para sincronizar
-        process_groups = db.query(models.LegalProcess.grouping_id).distinct().all()
-        process_numbers_to_sync = [item[0] for item in process_groups if item[0]]
+        # dono dos processos criados pela sincronização (incidências novas)
+        system_user = crud.get_or_create_default_user(db)
+        if not system_user:
+            raise RuntimeError("Não foi possível encontrar ou criar o usuário padrão.")
+
+        # 1. Pega os processos (CNJ) distintos para sincronizar
+        # GROUP BY (paralelizável no PG) em vez de DISTINCT; vazios filtrados no SQL
+        # Só entram processos nunca sincronizados ou consultados há mais de CRON_SYNC_MIN_INTERVAL_HOURS
+        stale_before = datetime.now(timezone.utc) - timedelta(hours=settings.CRON_SYNC_MIN_INTERVAL_HOURS)
+        process_numbers_to_sync = db.execute(
+            select(models.LegalProcess.process_number)
+            .where(models.LegalProcess.process_number != "")
+            .where(or_(
+                models.LegalProcess.last_synced_at.is_(None),
+                models.LegalProcess.last_synced_at < stale_before,
+            ))
+            .group_by(models.LegalProcess.process_number)
+        ).scalars().all()
+
+        print(f"Encontrados {len(process_numbers_to_sync)} processos para verificar.")
 
-        print(f"Encontrados {len(process_numbers_to_sync)} grupos de processos para verificar.")
+        # 2. Busca na API em paralelo (HTTP concorrente, sem tocar na sessão)
+        sem = asyncio.Semaphore(settings.CRON_SYNC_CONCURRENCY)
+        results = await asyncio.gather(
+            *(_fetch_latest(number, sem) for number in process_numbers_to_sync)
+        )
 
-        for number in process_numbers_to_sync:
+        # 3. Diff / notificação / upsert em sequência: a Session não é thread/task-safe
+        for number, latest_list in results:
             print(f"Sincronizando processo: {number}...")
-            
-            # 2. Busca os dados atuais do processo no banco
-            current_processes = db.query(models.LegalProcess).filter_by(grouping_id=number).all()
-            
-            # Mapeia as movimentações existentes para fácil comparação
-            existing_movements = {}
-            for proc in current_processes:
-                key = (proc.instance, proc.degree_numero)
-                existing_movements[key] = {mov.description for mov in proc.movements}
-
-            # 3. Busca os dados mais recentes da API
-            try:
-                # O serviço deve ser adaptado para retornar a estrutura completa da busca
-                latest_data = await jusbr_service.get_processo_search_results(number)
-                if not latest_data or "erro" in latest_data:
-                    print(f"Erro ao buscar dados para {number}: {latest_data.get('erro')}")
-                    continue
-            except Exception as e:
-                print(f"Exceção ao buscar dados para {number}: {e}")
+
+            if isinstance(latest_list, Exception):
+                print(f"Exceção ao buscar dados para {number}: {latest_list}")
+                continue
+            if not latest_list or latest_list[0].get("erro"):
+                print(f"Erro ao buscar dados para {number}: {(latest_list or [{}])[0].get('erro')}")
                 continue
 
-            # 4. Compara e notifica
-            tramitacoes = latest_data.get("content", [{}])[0].get("tramitacoes", [])
-            for tramitacao_data in tramitacoes:
-                key = crud.get_tramitacao_identifier(tramitacao_data)
-                current_movs_set = existing_movements.get(key, set())
-                
-                new_movements_list = []
-                for mov in tramitacao_data.get("movimentos", []):
-                    if mov['description'] not in current_movs_set:
-                        new_movements_list.append({
-                            "date": mov['dataHora'],
-                            "description": mov['description']
-                        })
+            # Movimentações existentes do processo numa única consulta (sem lazy-load por instância)
+            rows = db.execute(
+                select(
+                    models.LegalProcess.numero_unico_incidencia,
+                    models.ProcessMovement.description,
+                )
+                .outerjoin(models.LegalProcess.movements)
+                .where(models.LegalProcess.process_number == number)
+            ).all()
+
+            # Mapeia as movimentações existentes por incidência para fácil comparação
+            existing_movements = defaultdict(set)
+            for incidencia, description in rows:
+                descs = existing_movements[incidencia]
+                if description is not None:
+                    descs.add(description)
+
+            # 4. Compara e notifica (uma entrada por instância/incidência)
+            for process_data in latest_list:
+                key = process_data.get("numero_unico_incidencia")
+                tramitacao = process_data.get("tramitacaoAtual") or {}
+                current_movs_set = existing_movements.get(key) or _EMPTY
+
+                new_movements_list = [
+                    {"date": mov.get("dataHora"), "description": desc}
+                    for mov in tramitacao.get("movimentos") or ()
+                    if (desc := mov.get("descricao") or "") not in current_movs_set
+                ]
 
                 if new_movements_list:
-                    print(f"Novas movimentações encontradas para {number} (Instância: {key[0]}): {len(new_movements_list)}")
-                    
+                    print(f"Novas movimentações encontradas para {number} (Incidência: {key}): {len(new_movements_list)}")
+
                     # Envia notificação para o Discord
-                    process_title = tramitacao_data.get("classe", [{}])[0].get("descricao", "Processo")
+                    process_title = ((tramitacao.get("classe") or [{}])[0] or {}).get("descricao", "Processo")
                     embed = create_update_embed(number, new_movements_list, process_title)
-                    send_discord_notification(
+                    await send_discord_notification(
                         message=f" novas movimentações detectadas!",
                         embed=embed
                     )
-                    
-                    # Atualiza o processo no banco
-                    # O CRUD já deve estar preparado para isso
-                    crud.upsert_process_from_jusbr_data(db, latest_data, user_id="system") # Ou o ID de um usuário admin
+
+                    # Atualiza (ou cria) a incidência no banco; o upsert faz o próprio commit
+                    crud.upsert_process_from_jusbr_data(db, process_data, user_id=system_user.id)
                 else:
-                    print(f"Nenhuma nova movimentação para {number} (Instância: {key[0]}).")
-                    
+                    print(f"Nenhuma nova movimentação para {number} (Incidência: {key}).")
+
+            # Marca o processo como consultado (entra de novo só após o intervalo)
+            db.execute(
+                update(models.LegalProcess)
+                .where(models.LegalProcess.process_number == number)
+                .values(last_synced_at=datetime.now(timezone.utc))
+            )
+            db.commit()
+
     finally:
         db.close()
+        await aclose_client()
 
 if __name__ == "__main__":
-    asyncio.run(sync_all_processes())
\ No newline at end of file
+    asyncio.run(sync_all_processes())
@@ -1,13 +1,16 @@
 import logging
 import os
-import re
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
 
 from db import models
+from vigia.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +21,21 @@ cpj_engine = create_engine(
     pool_recycle=3600,
 )
 
-_CNJ_NON_DIGIT_RE = re.compile(r"\D+")
+class _KeepDigits(dict):
+    """Tabela p/ str.translate: mantém 0-9 e remove (com cache) qualquer outro code point."""
+
+    def __missing__(self, c: int) -> None:
+        self[c] = None
+        return None
+
+
+_KEEP_DIGITS = _KeepDigits({c: c for c in range(48, 58)})
 
 
 def _only_digits(s: Optional[str]) -> Optional[str]:
     if not s:
         return None
-    return _CNJ_NON_DIGIT_RE.sub("", s)
+    return s.translate(_KEEP_DIGITS)
 
 
 def cnj_digits(s: Optional[str]) -> Optional[str]:
@@ -38,7 +49,19 @@ def cnj_mask(digits20: str) -> str:
     return f"{digits20[0:7]}-{digits20[7:9]}.{digits20[9:13]}.{digits20[13]}.{digits20[14:16]}.{digits20[16:20]}"
 
 
-def get_latest_updated_cpj_processes(limit: int = 50) -> List[Dict[str, Any]]:
+@contextmanager
+def _cpj_conn(conn: Optional[Connection] = None) -> Iterator[Connection]:
+    """Reaproveita `conn` se informada; senão faz checkout de uma conexão do pool."""
+    if conn is not None:
+        yield conn
+        return
+    with cpj_engine.connect() as connection:
+        yield connection
+
+
+def get_latest_updated_cpj_processes(
+    limit: int = 50, conn: Optional[Connection] = None
+) -> List[Dict[str, Any]]:
     query = text(
         """
         SELECT
@@ -59,7 +82,7 @@ def get_latest_updated_cpj_processes(limit: int = 50) -> List[Dict[str, Any]]:
         LIMIT :limit
         """
     )
-    with cpj_engine.connect() as connection:
+    with _cpj_conn(conn) as connection:
         rows = connection.execute(query, {"limit": limit}).fetchall()
         logger.info(
             "Encontrados %d processos recentemente atualizados e válidos no CPJ.",
@@ -68,7 +91,9 @@ def get_latest_updated_cpj_processes(limit: int = 50) -> List[Dict[str, Any]]:
         return [dict(row._mapping) for row in rows]
 
 
-def _get_cpj_envolvidos(ficha: str, incidente: int) -> List[Dict[str, Any]]:
+def _get_cpj_envolvidos(
+    ficha: str, incidente: int, conn: Optional[Connection] = None
+) -> List[Dict[str, Any]]:
     query = text(
         """
         SELECT
@@ -80,14 +105,17 @@ def _get_cpj_envolvidos(ficha: str, incidente: int) -> List[Dict[str, Any]]:
         WHERE ce.ficha = :ficha AND ce.incidente = :incidente
         """
     )
-    with cpj_engine.connect() as connection:
+    with _cpj_conn(conn) as connection:
         rows = connection.execute(
             query, {"ficha": ficha, "incidente": incidente}
         ).fetchall()
         return [dict(row._mapping) for row in rows]
 
 
-def _get_cpj_andamentos(cod_agrupador: int) -> List[Dict[str, Any]]:
+def _iter_cpj_andamentos(
+    cod_agrupador: int, conn: Connection, page_size: Optional[int] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """Andamentos em páginas via cursor de servidor (memória limitada a `page_size` linhas)."""
     query = text(
         """
         SELECT data_andamento, texto_andamento
@@ -96,9 +124,12 @@ def _get_cpj_andamentos(cod_agrupador: int) -> List[Dict[str, Any]]:
         ORDER BY data_andamento ASC
         """
     )
-    with cpj_engine.connect() as connection:
-        rows = connection.execute(query, {"cod_agrupador": cod_agrupador}).fetchall()
-        return [dict(row._mapping) for row in rows]
+    page_size = page_size or settings.CPJ_ANDAMENTOS_PAGE_SIZE
+    result = conn.execution_options(yield_per=page_size).execute(
+        query, {"cod_agrupador": cod_agrupador}
+    )
+    for rows in result.partitions():
+        yield [dict(row._mapping) for row in rows]
 
 
 def _infer_tipo_pessoa(doc: str) -> str:
@@ -107,7 +138,10 @@ def _infer_tipo_pessoa(doc: str) -> str:
 
 
 def sync_process_from_cpj(
-    db: Session, user_id: str, cpj_data: Dict[str, Any]
+    db: Session,
+    user_id: str,
+    cpj_data: Dict[str, Any],
+    cpj_conn: Optional[Connection] = None,
 ) -> Optional[models.LegalProcess]:
     numero_processo_raw: Optional[str] = cpj_data.get("numero_processo")
     ficha: Optional[str] = cpj_data.get("ficha")
@@ -137,13 +171,17 @@ def sync_process_from_cpj(
     )
 
     processo_principal = None
-    processo_formatado = (
-        db.query(models.LegalProcess).filter_by(process_number=cnj_formatado).first()
+    # formatado e bruto numa única ida ao banco; despacho por process_number
+    candidatos = db.execute(
+        select(models.LegalProcess).where(
+            models.LegalProcess.process_number.in_({cnj_formatado, numero_processo_raw})
+        )
+    ).scalars().all()
+    processo_formatado = next(
+        (p for p in candidatos if p.process_number == cnj_formatado), None
     )
     processo_raw = (
-        db.query(models.LegalProcess)
-        .filter_by(process_number=numero_processo_raw)
-        .first()
+        next((p for p in candidatos if p.process_number == numero_processo_raw), None)
         if numero_processo_raw != cnj_formatado
         else None
     )
@@ -174,7 +212,7 @@ def sync_process_from_cpj(
     processo_principal.orgao_julgador = cpj_data.get("juizo")
     processo_principal.status = "Sincronizado do CPJ"
 
-    envolvidos = _get_cpj_envolvidos(ficha, cpj_data.get("incidente", 0))
+    envolvidos = _get_cpj_envolvidos(ficha, cpj_data.get("incidente", 0), conn=cpj_conn)
     if not processo_principal.parties:
         for p in envolvidos:
             polo = "ATIVO" if p.get("qualificacao") == 1 else "PASSIVO"
@@ -188,51 +226,58 @@ def sync_process_from_cpj(
 
     db.flush()
 
-    cpj_process_db = (
-        db.query(models.CPJProcess).filter_by(cpj_cod_processo=cod_processo_cpj).first()
-    )
-    if not cpj_process_db:
-        cpj_process_db = models.CPJProcess(
-            legal_process_id=processo_principal.id, cpj_cod_processo=cod_processo_cpj
+    # UPSERT atômico por cpj_cod_processo (uma ida ao banco, sem SELECT prévio)
+    cod_agrupador = cpj_data.get("cod_agrupador")
+    cpj_fields = {
+        "legal_process_id": processo_principal.id,
+        "cpj_cod_agrupador": cod_agrupador,
+        "ficha": ficha,
+        "incidente": cpj_data.get("incidente"),
+        "numero_processo": numero_processo_raw,
+        "juizo": cpj_data.get("juizo"),
+        "valor_causa": cpj_data.get("valor_causa"),
+        "entrada_date": cpj_data.get("entrada"),
+        "last_update_cpj": cpj_data.get("update_data_hora"),
+    }
+    cpj_process_id = db.execute(
+        pg_insert(models.CPJProcess)
+        .values(cpj_cod_processo=cod_processo_cpj, **cpj_fields)
+        .on_conflict_do_update(
+            index_elements=[models.CPJProcess.cpj_cod_processo], set_=cpj_fields
         )
-        db.add(cpj_process_db)
-    else:
-        cpj_process_db.legal_process_id = processo_principal.id
-
-    cpj_process_db.cpj_cod_agrupador = cpj_data.get("cod_agrupador")
-    cpj_process_db.ficha = ficha
-    cpj_process_db.incidente = cpj_data.get("incidente")
-    cpj_process_db.numero_processo = numero_processo_raw
-    cpj_process_db.juizo = cpj_data.get("juizo")
-    cpj_process_db.valor_causa = cpj_data.get("valor_causa")
-    cpj_process_db.entrada_date = cpj_data.get("entrada")
-    cpj_process_db.last_update_cpj = cpj_data.get("update_data_hora")
-
-    db.flush()
-
-    db.query(models.CPJParty).filter_by(process_id=cpj_process_db.id).delete()
-    for p in envolvidos:
-        documento = p.get("cpf_cnpj") or ""
-        db.add(
-            models.CPJParty(
-                process_id=cpj_process_db.id,
-                qualificacao=p.get("qualificacao"),
-                nome=p.get("nome"),
-                documento=documento,
-                tipo_pessoa=_infer_tipo_pessoa(documento),
-            )
-        )
-
-    if cpj_process_db.cpj_cod_agrupador:
-        db.query(models.CPJMovement).filter_by(process_id=cpj_process_db.id).delete()
-        for a in _get_cpj_andamentos(cpj_process_db.cpj_cod_agrupador):
-            db.add(
-                models.CPJMovement(
-                    process_id=cpj_process_db.id,
-                    data_andamento=a.get("data_andamento"),
-                    texto_andamento=a.get("texto_andamento"),
+        .returning(models.CPJProcess.id)
+    ).scalar_one()
+
+    # DELETE + INSERT em lote (executemany) na mesma transação do commit abaixo
+    db.query(models.CPJParty).filter_by(process_id=cpj_process_id).delete()
+    parties_payload = [
+        {
+            "process_id": cpj_process_id,
+            "qualificacao": p.get("qualificacao"),
+            "nome": p.get("nome"),
+            "documento": p.get("cpf_cnpj") or "",
+            "tipo_pessoa": _infer_tipo_pessoa(p.get("cpf_cnpj") or ""),
+        }
+        for p in envolvidos
+    ]
+    if parties_payload:
+        db.execute(insert(models.CPJParty), parties_payload)
+
+    if cod_agrupador:
+        db.query(models.CPJMovement).filter_by(process_id=cpj_process_id).delete()
+        with _cpj_conn(cpj_conn) as connection:
+            for andamentos in _iter_cpj_andamentos(cod_agrupador, connection):
+                db.execute(
+                    insert(models.CPJMovement),
+                    [
+                        {
+                            "process_id": cpj_process_id,
+                            "data_andamento": a.get("data_andamento"),
+                            "texto_andamento": a.get("texto_andamento"),
+                        }
+                        for a in andamentos
+                    ],
                 )
-            )
 
     processo_principal.last_update = datetime.now(timezone.utc)
 
@@ -2,9 +2,30 @@ from datetime import datetime, timezone
 import httpx
 import os
 
+try:
+    import h2  # noqa: F401  (habilita HTTP/2 no httpx)
+except ImportError:
+    h2 = None
+
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 
-def send_discord_notification(message: str, embed: dict = None):
+_client: httpx.AsyncClient | None = None
+
+def _get_client() -> httpx.AsyncClient:
+    """Cliente único (pool + TLS reaproveitados entre notificações)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(http2=h2 is not None, timeout=10.0)
+    return _client
+
+async def aclose_client() -> None:
+    """Fecha o cliente compartilhado (fim do script / shutdown da aplicação)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def send_discord_notification(message: str, embed: dict = None):
     """
     Envia uma notificação para um canal do Discord via webhook.
     """
@@ -19,9 +40,8 @@ def send_discord_notification(message: str, embed: dict = None):
         payload["embeds"] = [embed]
 
     try:
-        with httpx.Client() as client:
-            response = client.post(DISCORD_WEBHOOK_URL, json=payload)
-            response.raise_for_status()
+        response = await _get_client().post(DISCORD_WEBHOOK_URL, json=payload)
+        response.raise_for_status()
         print("Notificação enviada ao Discord com sucesso.")
     except httpx.HTTPStatusError as e:
         print(f"Erro ao enviar notificação ao Discord: {e.response.status_code} - {e.response.text}")
@@ -1,12 +1,18 @@
+import re
 import structlog
-from typing import List, Optional, Dict
-from collections import defaultdict
+from typing import Callable, Iterable, Iterator, List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
 
 from vigia.config import settings
 from ..ports.graph_client_port import GraphClientPort
 from ..ports.email_repository_port import EmailRepositoryPort
 from ..dto.email_dto import EmailDTO, FolderDTO
 
+try:
+    import ahocorasick  # pyahocorasick (opcional)
+except ImportError:
+    ahocorasick = None
+
 logger = structlog.get_logger(__name__)
 
 class EmailImporterService:
@@ -22,10 +28,63 @@ class EmailImporterService:
         self.graph_client = graph_client
         self.email_repo = email_repo
         self.sent_folder_name = settings.SENT_FOLDER_NAME.lower()
+        self._subject_match = self._compile_any(settings.SUBJECT_FILTER)
+        self._ignore_recip_match = self._compile_any(settings.IGNORED_RECIPIENT_PATTERNS)
+
+    @staticmethod
+    def _compile_any(patterns: List[str]) -> Optional[Callable[[str], bool]]:
+        """
+        Matcher "contém algum dos padrões" sobre texto já em minúsculas (padrões são
+        normalizados aqui): um único passe por Aho-Corasick se o pyahocorasick estiver
+        instalado, senão alternância regex. None se a lista estiver vazia.
+        """
+        pats = {p.lower() for p in patterns if p}
+        if not pats:
+            return None
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for p in pats:
+                automaton.add_word(p, p)
+            automaton.make_automaton()
+            return lambda s: next(automaton.iter(s), None) is not None
+        regex = re.compile("|".join(map(re.escape, pats)))
+        return lambda s: regex.search(s) is not None
+
+    def _fetch_full_conversations(self, account_email: str, conv_ids: List[str]) -> Dict[str, List[EmailDTO]]:
+        """Busca as threads completas em paralelo (I/O de rede; limitado por EMAIL_THREAD_FETCH_WORKERS)."""
+        if not conv_ids:
+            return {}
+        max_workers = min(len(conv_ids), settings.EMAIL_THREAD_FETCH_WORKERS or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            results = ex.map(
+                lambda conv_id: self.graph_client.fetch_conversation_thread(account_email, conv_id),
+                conv_ids,
+            )
+            return dict(zip(conv_ids, results))
 
     def _enrich_threads_with_full_conversation(self, account_email: str, threads_data: dict[str, dict]) -> None:
         ORG_PARTS = [d.lower() for d in getattr(settings, "ORG_DOMAINS", ["amaralvasconcellos.com.br","pavcob.com.br"])]
 
+        if not threads_data:
+            return
+
+        # Só busca a conversa completa quando o Graph (todas as pastas) tem mais mensagens
+        # do que a thread já armazenada; as mensagens do lote vêm só dos Enviados
+        conv_ids = list(threads_data)
+        counts = self.graph_client.fetch_conversation_counts(account_email, conv_ids)
+        stored = self.email_repo.get_message_counts(conv_ids)
+        to_fetch = [
+            conv_id for conv_id in conv_ids
+            if conv_id not in counts or stored.get(conv_id, 0) < counts[conv_id]
+        ]
+        # Threads já completas no banco não têm nada novo: saem do lote, senão o upsert
+        # regravaria participants/last_email_date só com o que veio dos Enviados
+        fetch_set = set(to_fetch)
+        for conv_id in conv_ids:
+            if conv_id not in fetch_set:
+                del threads_data[conv_id]
+        full_threads = self._fetch_full_conversations(account_email, to_fetch)
+
         for conv_id, data in list(threads_data.items()):
             participants_set = set()
             for p in (data.get("participants") or []):
@@ -33,34 +92,25 @@ class EmailImporterService:
                     participants_set.add(p.lower())
             data["participants"] = participants_set
 
-            dates_list = list(data.get("dates") or [])
-            if not dates_list:
-                if data.get("first_email_date"):
-                    dates_list.append(data["first_email_date"])
-                if data.get("last_email_date") and data["last_email_date"] != data.get("first_email_date"):
-                    dates_list.append(data["last_email_date"])
-                for msg in (data.get("messages") or []):
-                    dt = getattr(msg, "sent_datetime", None)
-                    if dt:
-                        dates_list.append(dt)
-            data["dates"] = dates_list
-
-            full_msgs = self.graph_client.fetch_conversation_thread(account_email, conv_id)
+            first_dt = data.get("first_email_date")
+            last_dt = data.get("last_email_date")
+
+            full_msgs = full_threads.get(conv_id)
             if not full_msgs:
                 data["participants"] = sorted(participants_set)
                 continue
 
-            seen_ids = {m.id for m in data["messages"]}
-            seen_internet_ids = {
-                m.internet_message_id for m in data["messages"]
-                if getattr(m, "internet_message_id", None)
+            # dedup + merge num único dict (chave: internetMessageId, senão id do Graph)
+            by_key: Dict[str, EmailDTO] = {
+                (m.internet_message_id or m.id): m for m in data["messages"]
             }
 
             for m in full_msgs:
-                if m.id in seen_ids or (m.internet_message_id and m.internet_message_id in seen_internet_ids):
+                k = m.internet_message_id or m.id
+                if k in by_key:
                     continue
+                by_key[k] = m
 
-                data["messages"].append(m)
                 if m.from_address:
                     participants_set.add(m.from_address.lower())
                 for r in (m.to_addresses or []):
@@ -68,35 +118,40 @@ class EmailImporterService:
                         participants_set.add(r.lower())
                 dt = getattr(m, "sent_datetime", None)
                 if dt:
-                    data["dates"].append(dt)
-
-                # >>> ATUALIZE OS SETS AQUI (dentro do loop)
-                seen_ids.add(m.id)
-                if m.internet_message_id:
-                    seen_internet_ids.add(m.internet_message_id)
-
-            if data["dates"]:
-                data["first_email_date"] = min(data["dates"])
-                data["last_email_date"]  = max(data["dates"])
+                    if first_dt is None or dt < first_dt:
+                        first_dt = dt
+                    if last_dt is None or dt > last_dt:
+                        last_dt = dt
+
+            data["messages"] = list(by_key.values())
+            data["first_email_date"] = first_dt
+            data["last_email_date"] = last_dt
             if not data.get("subject") and full_msgs:
                 data["subject"] = full_msgs[0].subject
 
             data["participants"] = sorted(participants_set)
-            # se não quiser levar 'dates' adiante:
-            # data.pop("dates", None)
 
             
     def run_import_for_all_accounts(self):
         """Ponto de entrada principal para a importação."""
         log = logger.bind(service="EmailImporterService")
         log.info("service.run_import.start")
-        for account_email in settings.EMAIL_ACCOUNTS:
-            try:
-                self.import_emails_for_account(account_email)
-            except Exception:
-                log.exception("service.import_for_account.failed", account_email=account_email)
+        # Corrige message_count de threads antigas antes de comparar contagens/ordenar por tamanho
+        self.email_repo.backfill_message_counts()
+        accounts = list(settings.EMAIL_ACCOUNTS)
+        if accounts:
+            # Contas em paralelo (I/O de rede); o repositório abre uma Session por chamada
+            max_workers = min(len(accounts), settings.EMAIL_ACCOUNT_IMPORT_WORKERS or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                list(ex.map(self._safe_import, accounts))
         log.info("service.run_import.finish")
 
+    def _safe_import(self, account_email: str) -> None:
+        try:
+            self.import_emails_for_account(account_email)
+        except Exception:
+            logger.exception("service.import_for_account.failed", service="EmailImporterService", account_email=account_email)
+
     def import_emails_for_account(self, account_email: str):
         log = logger.bind(account_email=account_email)
         log.info("service.account.start_processing")
@@ -107,17 +162,22 @@ class EmailImporterService:
             log.warning("service.sent_folder.not_found")
             return
 
+        # Filtro e agregação consomem as páginas em fluxo: a caixa nunca é materializada inteira
         sent_emails = self.graph_client.fetch_messages_in_folder(
-            account_email=account_email, folder_id=sent_folder.id
+            account_email=account_email,
+            folder_id=sent_folder.id,
+            odata_filter=self._subject_odata_filter(),
+        )
+        threads_data = self._process_emails_into_threads(self._filter_relevant_emails(sent_emails))
+        log.info(
+            "service.emails.filtered",
+            relevant=sum(len(t["messages"]) for t in threads_data.values()),
+            threads=len(threads_data),
         )
 
-        relevant_emails = self._filter_relevant_emails(sent_emails)
-        log.info("service.emails.filtered", initial=len(sent_emails), relevant=len(relevant_emails))
-
-        if not relevant_emails:
+        if not threads_data:
             return
 
-        threads_data = self._process_emails_into_threads(relevant_emails)
         self._enrich_threads_with_full_conversation(account_email, threads_data)
         if threads_data:
             saved_count = self.email_repo.save_threads_and_messages(threads_data)
@@ -131,41 +191,49 @@ class EmailImporterService:
             None,
         )
 
-    def _filter_relevant_emails(self, emails: List[EmailDTO]) -> List[EmailDTO]:
-        """Aplica as regras de negócio para filtrar e-mails que devem ser analisados."""
-        filtered_by_subject = [
-            email for email in emails
-            if any(expr.lower() in (email.subject or "").lower() for expr in settings.SUBJECT_FILTER)
+    @staticmethod
+    def _subject_odata_filter() -> Optional[str]:
+        """`contains(subject,'X') or ...` a partir de SUBJECT_FILTER (aspas escapadas p/ OData)."""
+        exprs = [
+            "contains(subject,'{}')".format(s.replace("'", "''"))
+            for s in settings.SUBJECT_FILTER
         ]
-        
-        final_list = []
-        for email in filtered_by_subject:
-            recipients_str = " ".join(email.to_addresses).lower()
-            if not any(pattern.lower() in recipients_str for pattern in settings.IGNORED_RECIPIENT_PATTERNS):
-                final_list.append(email)
-        return final_list
-
-    def _process_emails_into_threads(self, emails: List[EmailDTO]) -> Dict[str, Dict]:
-        """Agrega uma lista de e-mails em um dicionário estruturado por thread."""
-        threads = defaultdict(lambda: {
-            "messages": [],
-            "participants": set(),
-            "dates": []
-        })
+        return " or ".join(exprs) or None
+
+    def _filter_relevant_emails(self, emails: Iterable[EmailDTO]) -> Iterator[EmailDTO]:
+        """Aplica as regras de negócio para filtrar e-mails que devem ser analisados."""
+        if self._subject_match is None:
+            return
+
         for email in emails:
-            threads[email.conversation_id]["messages"].append(email)
-            threads[email.conversation_id]["participants"].add(email.from_address)
-            threads[email.conversation_id]["participants"].update(email.to_addresses)
-            threads[email.conversation_id]["dates"].append(email.sent_datetime)
-
-        processed_threads = {}
-        for conv_id, data in threads.items():
-            first_message = min(data["messages"], key=lambda m: m.sent_datetime)
-            processed_threads[conv_id] = {
-                "subject": first_message.subject,
-                "first_email_date": min(data["dates"]),
-                "last_email_date": max(data["dates"]),
-                "participants": list(filter(None, data["participants"])),
-                "messages": data["messages"]
-            }
-        return processed_threads
\ No newline at end of file
+            if not self._subject_match(email.subject_lc):
+                continue
+            if self._ignore_recip_match is not None and self._ignore_recip_match(email.recipients_lc):
+                continue
+            yield email
+
+    def _process_emails_into_threads(self, emails: Iterable[EmailDTO]) -> Dict[str, Dict]:
+        """Agrega um fluxo de e-mails em um dicionário estruturado por thread."""
+        # Passe único: já monta o formato final (subject/datas acompanham a 1ª/última mensagem)
+        threads: Dict[str, Dict] = {}
+        for email in emails:
+            t = threads.get(email.conversation_id)
+            dt = email.sent_datetime
+            if t is None:
+                t = threads[email.conversation_id] = {
+                    "subject": email.subject,
+                    "first_email_date": dt,
+                    "last_email_date": dt,
+                    "participants": set(),
+                    "messages": [],
+                }
+            elif dt < t["first_email_date"]:
+                t["first_email_date"] = dt
+                t["subject"] = email.subject
+            elif dt > t["last_email_date"]:
+                t["last_email_date"] = dt
+            t["messages"].append(email)
+            if email.from_address:
+                t["participants"].add(email.from_address)
+            t["participants"].update(filter(None, email.to_addresses))
+        return threads
\ No newline at end of file
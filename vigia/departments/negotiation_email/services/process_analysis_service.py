@@ -1,31 +1,38 @@
+import asyncio
 import json
 import re
 from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from db import models
+from db.session import SessionLocal
+from vigia.config import settings
 from vigia.departments.negotiation_email.services.process_orchestrator_service import ProcessStatusOrchestrator
 
+_BR_DATE_RE = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+
 def _parse_date_from_str(text: str) -> datetime | None:
     if not text:
         return None
-    match = re.search(r'(\d{2})/(\d{2})/(\d{4})', text)
+    match = _BR_DATE_RE.search(text)
     if match:
         try:
-            return datetime.strptime(match.group(0), '%d/%m/%Y').replace(tzinfo=timezone.utc)
+            # dd/mm/aaaa direto dos grupos (sem strptime/locale)
+            return datetime(int(match[3]), int(match[2]), int(match[1]), tzinfo=timezone.utc)
         except ValueError:
             return None
     return None
 
-def _save_transit_analysis(db: Session, proc: models.LegalProcess, result: dict):
-    """Lógica idempotente para salvar/atualizar uma análise de trânsito em julgado."""
-    existing_analysis = db.query(models.TransitAnalysis).filter_by(process_id=proc.id).first()
-
+def _transit_row(process_id, result: dict) -> dict:
     date_text = " ".join(result.get("movimentacoes_chave") or [])
     transit_date = _parse_date_from_str(date_text)
     if not transit_date:
         transit_date = _parse_date_from_str(result.get("justificativa", ""))
-    
-    data = {
+
+    return {
+        "process_id": process_id,
         "category": result.get("category"),
         "subcategory": result.get("subcategory"),
         "status": result.get("status"),
@@ -35,45 +42,62 @@ def _save_transit_analysis(db: Session, proc: models.LegalProcess, result: dict)
         "analysis_raw_data": result,
     }
 
-    if existing_analysis:
-        for key, value in data.items():
-            setattr(existing_analysis, key, value)
-    else:
-        new_analysis = models.TransitAnalysis(process_id=proc.id, **data)
-        db.add(new_analysis)
-
-def _save_post_sentence_analysis(db: Session, proc: models.LegalProcess, result: dict):
-    """Lógica idempotente para salvar/atualizar uma análise de fase recursal."""
-    existing_analysis = db.query(models.PostSentenceAnalysis).filter_by(process_id=proc.id).first()
-
-    appeal_date = _parse_date_from_str(result.get("data_interposicao_recurso", ""))
-
-    data = {
+def _post_sentence_row(process_id, result: dict) -> dict:
+    return {
+        "process_id": process_id,
         "category": result.get("category"),
         "subcategory": result.get("subcategory"),
         "status": result.get("status"),
         "justification": result.get("justificativa"),
         "key_movements": result.get("movimentacoes_chave"),
-        "appeal_date": appeal_date,
+        "appeal_date": _parse_date_from_str(result.get("data_interposicao_recurso", "")),
         "analysis_raw_data": result,
     }
 
-    if existing_analysis:
-        for key, value in data.items():
-            setattr(existing_analysis, key, value)
-    else:
-        new_analysis = models.PostSentenceAnalysis(process_id=proc.id, **data)
-        db.add(new_analysis)
-
-
-async def run_process_analysis(process_id: str, db: Session) -> dict:
-    """
-    Orquestra a análise de status de um processo, decidindo qual tipo de análise
-    realizar e onde persistir o resultado.
-    """
+def _upsert_analyses(db: Session, model, rows: List[dict]) -> None:
+    """UPSERT idempotente por process_id (único): uma ida ao banco para o lote inteiro."""
+    if not rows:
+        return
+    # ON CONFLICT não aceita a mesma chave duas vezes no mesmo statement: fica a última
+    rows = list({r["process_id"]: r for r in rows}.values())
+    stmt = pg_insert(model)
+    cols = [k for k in rows[0] if k != "process_id"]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.process_id],
+        set_={**{k: stmt.excluded[k] for k in cols}, "updated_at": func.now()},
+    )
+    db.execute(stmt, rows)
+
+def _persist_analyses(db: Session, results: List[Tuple[Any, dict]]) -> None:
+    """Decide onde persistir cada resultado (por categoria) e grava tudo em lote; não comita."""
+    transit_rows, post_sentence_rows = [], []
+    now = datetime.now(timezone.utc)
+    process_rows = []
+    for process_id, analysis_result in results:
+        category = analysis_result.get("category")
+        if category == "Fase Recursal":
+            post_sentence_rows.append(_post_sentence_row(process_id, analysis_result))
+        elif category in ["Trânsito em Julgado", "Em Andamento", "Análise Inconclusiva"]:
+            # Persiste todos os outros casos na tabela de Trânsito, que serve como status geral.
+            transit_rows.append(_transit_row(process_id, analysis_result))
+        else:
+            # Não salva se a categoria for desconhecida
+            print(f"Categoria desconhecida recebida do orquestrador: {category}")
+        # Campos gerais do processo
+        process_rows.append({"id": process_id, "analysis_content": analysis_result, "last_update": now})
+
+    _upsert_analyses(db, models.TransitAnalysis, transit_rows)
+    _upsert_analyses(db, models.PostSentenceAnalysis, post_sentence_rows)
+    if process_rows:
+        # UPDATE em lote por chave primária
+        db.execute(update(models.LegalProcess), process_rows)
+
+
+async def _analyze_process(process_id: str, db: Session) -> Tuple[Any, dict]:
+    """Roda o orquestrador para um processo; devolve (id, resultado) ou (None, erro)."""
     proc = db.query(models.LegalProcess).filter(models.LegalProcess.id == process_id).first()
     if not proc:
-        return {"erro": "Processo não encontrado"}
+        return None, {"erro": "Processo não encontrado"}
 
     # 1. Chamar o orquestrador para obter o resultado da análise
     orchestrator = ProcessStatusOrchestrator(db)
@@ -82,24 +106,58 @@ async def run_process_analysis(process_id: str, db: Session) -> dict:
     try:
         analysis_result = json.loads(analysis_result_raw) if isinstance(analysis_result_raw, str) else analysis_result_raw
     except (json.JSONDecodeError, TypeError):
-        return {"erro": "Falha ao decodificar a resposta do agente ou orquestrador."}
-
-    # 2. DECIDIR ONDE PERSISTIR com base na categoria
-    category = analysis_result.get("category")
-    if category == "Fase Recursal":
-        _save_post_sentence_analysis(db, proc, analysis_result)
-    elif category in ["Trânsito em Julgado", "Em Andamento", "Análise Inconclusiva"]:
-        # Persiste todos os outros casos na tabela de Trânsito, que serve como status geral.
-        _save_transit_analysis(db, proc, analysis_result)
-    else:
-        # Não salva se a categoria for desconhecida
-        print(f"Categoria desconhecida recebida do orquestrador: {category}")
-
-
-    # 3. Atualizar campos gerais do processo e comitar
-    if hasattr(proc, 'analysis_content'):
-        proc.analysis_content = analysis_result
-    proc.last_update = datetime.now(timezone.utc)
+        return None, {"erro": "Falha ao decodificar a resposta do agente ou orquestrador."}
+    return proc.id, analysis_result
+
+
+async def run_process_analysis(process_id: str, db: Session) -> dict:
+    """
+    Orquestra a análise de status de um processo, decidindo qual tipo de análise
+    realizar e onde persistir o resultado.
+    """
+    proc_id, analysis_result = await _analyze_process(process_id, db)
+    if proc_id is None:
+        return analysis_result
+
+    # 2. Persistir (UPSERT) e comitar
+    _persist_analyses(db, [(proc_id, analysis_result)])
     db.commit()
 
-    return analysis_result
\ No newline at end of file
+    return analysis_result
+
+
+async def run_process_analysis_batch(
+    process_ids: Iterable[str],
+    session_factory: Callable[[], Session] = SessionLocal,
+    concurrency: Optional[int] = None,
+) -> List[dict | BaseException]:
+    """
+    Analisa vários processos em paralelo (limitado por PROCESS_ANALYSIS_CONCURRENCY).
+    Cada análise lê com a sua própria Session; a persistência sai em lote, com um único commit.
+    Exceções voltam no lugar do resultado.
+    """
+    sem = asyncio.Semaphore(concurrency or settings.PROCESS_ANALYSIS_CONCURRENCY)
+
+    async def _one(process_id: str) -> Tuple[Any, dict]:
+        async with sem:
+            db = session_factory()
+            try:
+                return await _analyze_process(process_id, db)
+            finally:
+                db.close()
+
+    outcomes = await asyncio.gather(*(_one(pid) for pid in process_ids), return_exceptions=True)
+
+    to_persist = [o for o in outcomes if not isinstance(o, BaseException) and o[0] is not None]
+    if to_persist:
+        db = session_factory()
+        try:
+            _persist_analyses(db, to_persist)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    return [o if isinstance(o, BaseException) else o[1] for o in outcomes]
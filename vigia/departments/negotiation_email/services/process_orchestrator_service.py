@@ -1,8 +1,17 @@
+import re
 from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Tuple
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import Session
 from db import models
 from vigia.departments.negotiation_email.agents.judicial_jury_agents import PostSentenceAgent, TransitInRemJudicatamAgent
 
+try:
+    import ahocorasick  # pyahocorasick (opcional)
+except ImportError:
+    ahocorasick = None
+
 # --- Palavras-chave para o Roteamento ---
 # Casos que devem ser encerrados rapidamente sem IA
 CUTOFF_KEYWORDS = [
@@ -23,60 +32,124 @@ TRANSITO_KEYWORDS = [
     "renúncia ao prazo", "baixa definitiva", "arquivado definitivamente", "cumprimento de sentença definitivo"
 ]
 
+_KEYWORD_GROUPS = {
+    "CUTOFF": CUTOFF_KEYWORDS,
+    "RECURSAL": RECURSAL_KEYWORDS,
+    "TRANSITO": TRANSITO_KEYWORDS,
+}
+# keyword -> (grupo, posição na lista do grupo)
+_KEYWORD_INDEX = {
+    kw: (group, i) for group, kws in _KEYWORD_GROUPS.items() for i, kw in enumerate(kws)
+}
+
+# Todas as listas num único autômato/alternância: um só passe sobre as descrições
+if ahocorasick is not None:
+    _KW_AC = ahocorasick.Automaton()
+    for _kw, _hit in _KEYWORD_INDEX.items():
+        _KW_AC.add_word(_kw, _hit)
+    _KW_AC.make_automaton()
+    _KW_RE = None
+else:
+    _KW_AC = None
+    _KW_RE = re.compile("|".join(map(re.escape, sorted(_KEYWORD_INDEX, key=len, reverse=True))))
+
+
+def _match_keywords(text: str) -> Dict[str, str]:
+    """Grupo -> primeira keyword do grupo (na ordem da lista) presente no texto."""
+    if _KW_AC is not None:
+        hits = (hit for _, hit in _KW_AC.iter(text))
+    else:
+        hits = (_KEYWORD_INDEX[m.group(0)] for m in _KW_RE.finditer(text))
+    best: Dict[str, int] = {}
+    for group, i in hits:
+        if i < best.get(group, len(_KEYWORD_GROUPS[group])):
+            best[group] = i
+    return {group: _KEYWORD_GROUPS[group][i] for group, i in best.items()}
+
+
+@lru_cache(maxsize=1)
+def _get_agents() -> Tuple[TransitInRemJudicatamAgent, PostSentenceAgent]:
+    """Agentes sem estado por processo: instanciados uma vez e compartilhados entre orquestradores."""
+    return TransitInRemJudicatamAgent(), PostSentenceAgent()
+
+
 class ProcessStatusOrchestrator:
     def __init__(self, db_session: Session):
         self.db = db_session
-        self.transit_agent = TransitInRemJudicatamAgent()
-        self.post_sentence_agent = PostSentenceAgent()
+        self.transit_agent, self.post_sentence_agent = _get_agents()
 
     def _get_process_data(self, process: models.LegalProcess):
         """Coleta e formata os dados necessários para os agentes."""
-        movements = sorted(process.movements, key=lambda m: m.date, reverse=False)
-        last_50_movements = movements[-50:]
-        
+        # Últimas 50 movimentações direto do banco (ORDER BY ... LIMIT), sem carregar a relação inteira
+        last_50_movements = self.db.execute(
+            select(models.ProcessMovement)
+            .where(models.ProcessMovement.process_id == process.id)
+            .order_by(models.ProcessMovement.date.desc())
+            .limit(50)
+        ).scalars().all()[::-1]
+
         movimentos_payload = [
             {"data": m.date.isoformat(), "descricao": m.description.lower()} for m in last_50_movements
         ]
 
-        documentos_relevantes = [d for d in process.documents if d.document_type and \
-            any(term in d.document_type.lower() for term in ['sentença', 'acórdão', 'decisão'])]
-        
-        trechos_decisoes = ""
-        for doc in documentos_relevantes:
-            if doc.text_content:
-                trechos_decisoes += f"\n---\nDOCUMENTO: {doc.name}\nDATA: {doc.juntada_date}\nCONTEÚDO:\n{doc.text_content[:2000]}...\n---\n"
-        
-        return movimentos_payload, trechos_decisoes
+        # Só documentos decisórios e só as colunas usadas; o texto já vem cortado em 2000 chars pelo PG
+        documentos_relevantes = self.db.execute(
+            select(
+                models.ProcessDocument.name,
+                models.ProcessDocument.doc_type_norm,
+                models.ProcessDocument.juntada_date,
+                func.left(models.ProcessDocument.text_content, 2000).label("snippet"),
+            )
+            .where(
+                models.ProcessDocument.process_id == process.id,
+                # coluna gerada já normalizada (minúscula/sem acento): LIKE simples, sem ILIKE por linha
+                or_(*(
+                    models.ProcessDocument.doc_type_norm.contains(term)
+                    for term in ('sentenca', 'acordao', 'decisao')
+                )),
+            )
+            .order_by(models.ProcessDocument.juntada_date)
+        ).all()
+
+        trechos_decisoes = "".join(
+            f"\n---\nDOCUMENTO: {doc.name}\nDATA: {doc.juntada_date}\nCONTEÚDO:\n{doc.snippet}...\n---\n"
+            for doc in documentos_relevantes
+            if doc.snippet
+        )
+
+        return movimentos_payload, trechos_decisoes, documentos_relevantes
 
     async def analyze(self, process: models.LegalProcess) -> dict:
         """
         Executa o fluxo de análise completo (MoE).
         """
-        movimentos_payload, trechos_decisoes = self._get_process_data(process)
+        movimentos_payload, trechos_decisoes, documentos_relevantes = self._get_process_data(process)
         all_descriptions = " ".join([m['descricao'] for m in movimentos_payload])
 
+        matches = _match_keywords(all_descriptions)
+
         # Etapa 1: Pré-Filtro Rápido (Cutoff)
-        for keyword in CUTOFF_KEYWORDS:
-            if keyword in all_descriptions:
-                return {
-                    "category": "Em Andamento",
-                    "subcategory": f"Atividade de instrução recente ('{keyword}')",
-                    "status": "Não Aplicável",
-                    "justificativa": "Processo em fase de instrução ou movimentação inicial, análise de finalização não aplicável.",
-                    "source": "Orchestrator Cutoff"
-                }
+        keyword = matches.get("CUTOFF")
+        if keyword:
+            return {
+                "category": "Em Andamento",
+                "subcategory": f"Atividade de instrução recente ('{keyword}')",
+                "status": "Não Aplicável",
+                "justificativa": "Processo em fase de instrução ou movimentação inicial, análise de finalização não aplicável.",
+                "source": "Orchestrator Cutoff"
+            }
 
         # Etapa 2: Roteamento para Especialista
-        if any(keyword in all_descriptions for keyword in RECURSAL_KEYWORDS):
+        if "RECURSAL" in matches:
             print(f"Processo {process.process_number}: Roteado para Agente de Fase Recursal.")
             return await self.post_sentence_agent.execute(movimentos_payload, trechos_decisoes)
 
-        if any(keyword in all_descriptions for keyword in TRANSITO_KEYWORDS):
+        if "TRANSITO" in matches:
             print(f"Processo {process.process_number}: Roteado para Agente de Trânsito em Julgado.")
             return await self.transit_agent.execute(movimentos_payload, trechos_decisoes)
 
         # Etapa 3: Heurística Temporal
-        sentencas = [d for d in process.documents if d.document_type and 'sentença' in d.document_type.lower()]
+        sentencas = [d for d in documentos_relevantes if 'sentenca' in d.doc_type_norm]
         if sentencas:
             ultima_sentenca = max(sentencas, key=lambda d: d.juntada_date)
             dias_desde_sentenca = (datetime.now(timezone.utc) - ultima_sentenca.juntada_date).days
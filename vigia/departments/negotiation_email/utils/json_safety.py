@@ -1,9 +1,37 @@
+import asyncio
 import json
 import re
 import logging
-from typing import Any, Dict, Union
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple, Union
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from vigia.config import settings
+
 logger = logging.getLogger(__name__)
 
+_REPAIR_POOL: Optional[ProcessPoolExecutor] = None
+_REPAIR_POOL_LOCK = threading.Lock()
+_REPAIR_POOL_DISABLED = False
+_REPAIR_POOL_PID: Optional[int] = None  # pool herdado via fork não funciona no filho
+
+
+def _loads(s: str) -> Any:
+    """orjson quando disponível; o stdlib cobre o que ele recusa (NaN/Infinity, int > 64 bits)."""
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
 def _strip_code_fences(s: str) -> str:
     s = s.strip()
     if s.startswith("```"):
@@ -13,167 +41,179 @@ def _strip_code_fences(s: str) -> str:
             s = s[nl+1:]
     return s.strip()
 
-def _escape_newlines_inside_strings(s: str) -> str:
-    out, in_str, esc = [], False, False
-    for ch in s:
-        if in_str:
-            if ch == '\n': 
-                out.append('\\n')
-                continue
-            if ch == '\r': 
-                out.append('\\r')
-                continue
-            if esc: 
-                esc = False
-                out.append(ch)
-                continue
-            if ch == '\\': 
-                esc = True
-                out.append(ch)
-                continue
-            if ch == '"': 
-                in_str = False
-                out.append(ch)
-                continue
-            out.append(ch)
-            continue
-        else:
-            out.append(ch)
-            if ch == '"': 
-                in_str = True
-    return ''.join(out)
+# Os reparos andam por blocos casados em C (regex) em vez de caractere a caractere:
+# um bloco é uma sequência de texto e literais string completos sem '{'/'}' fora de string.
+_STR = r'"(?:[^"\\]+|\\.)*(?:"|\\?\Z)'
+_STRING_RE = re.compile(_STR, re.DOTALL)
+_CHUNK_RE = re.compile(r'(?:[^"{}]+|' + _STR + r')+|[{}]', re.DOTALL)
+_KEY_AFTER_BRACE_RE = re.compile(r'\s*,\s*"')
+# Dentro da string, '\' seguido de quebras de linha continua "escapando" o próximo caractere
+_STR_NL = r'"(?:[^"\\]+|\\[\n\r]*[^\n\r])*(?:"|(?:\\[\n\r]*)?\Z)'
+_STRING_NL_RE = re.compile(_STR_NL)
+_REPAIR_TOKEN_RE = re.compile(
+    # trecho sem nada a reparar: texto, strings e vírgulas isoladas que não precedem '}'/']'
+    r'(?P<txt>(?:[^"{},]+|,(?!\s*[,}\]])|' + _STR_NL + r')+)'
+    # sequência de vírgulas: descartada inteira se vier antes de '}'/']'
+    r'|(?P<comma>(?:,\s*)+)'
+    r'|(?P<close>\})'
+    r'|(?P<open>\{)'
+)
+
 
-def _fix_trailing_commas(s: str) -> str:
-    # ,}  -> }
-    # ,]  -> ]
-    return re.sub(r',\s*([}\]])', r'\1', s)
+def _escape_string_newlines(m: "re.Match[str]") -> str:
+    return m.group(0).replace('\n', '\\n').replace('\r', '\\r')
 
-def _drop_stray_closing_brace_at_level1(s: str) -> str:
+
+def _repair(s: str) -> str:
     """
-    Remove um '}' indevido quando estamos no nível 1 e logo em seguida vem ', "chave"'.
-    Isso converte '... "campo":"...", }, "outra": ...' em '... "campo":"...", "outra": ...'
+    Reparos leves num único passe:
+    - remove vírgula(s) pendurada(s) antes de '}' / ']' (também em sequência: ',,}' / ', ,]');
+    - remove um '}' indevido no nível 1 seguido de ', "chave"'
+      ('... "campo":"...", }, "outra": ...' -> '... "campo":"...", "outra": ...');
+    - escapa quebras de linha cruas dentro de strings.
     """
     out = []
-    i, n = 0, len(s)
     depth = 0
-    in_str = False
-    esc = False
-    while i < n:
-        ch = s[i]
-        if in_str:
-            out.append(ch)
-            if esc: 
-                esc = False
-            elif ch == '\\': 
-                esc = True
-            elif ch == '"': 
-                in_str = False
-            i += 1
-            continue
-        if ch == '"':
-            in_str = True
-            out.append(ch)
-            i += 1
-            continue
-        if ch == '{':
-            depth += 1
-            out.append(ch)
-            i += 1
-            continue
-        if ch == '}':
+    for m in _REPAIR_TOKEN_RE.finditer(s):
+        kind = m.lastgroup
+        tok = m.group(0)
+        if kind == 'txt':
+            if '"' in tok and ('\n' in tok or '\r' in tok):
+                tok = _STRING_NL_RE.sub(_escape_string_newlines, tok)
+            out.append(tok)
+        elif kind == 'comma':
+            if s[m.end():m.end() + 1] not in ('}', ']'):
+                out.append(tok)
+        elif kind == 'close':
             # lookahead: espaços + vírgula + espaços + aspas
-            j = i + 1
-            while j < n and s[j].isspace():
-                j += 1
-            if depth == 1 and j < n and s[j] == ',':
-                k = j + 1
-                while k < n and s[k].isspace():
-                    k += 1
-                if k < n and s[k] == '"':
-                    # drop this brace (não adiciona)
-                    i += 1
-                    continue
-            # remove vírgula pendurada imediatamente antes de }
-            while out and out[-1].isspace():
-                out.pop()
-            if out and out[-1] == ',':
-                out.pop()
+            if depth == 1 and _KEY_AFTER_BRACE_RE.match(s, m.end()):
+                continue  # drop this brace (não adiciona)
             depth -= 1
             out.append('}')
-            i += 1
-            continue
-        out.append(ch)
-        i += 1
+        elif kind == 'open':
+            depth += 1
+            out.append(tok)
     return ''.join(out)
 
 def _extract_first_balanced_json(s: str) -> str:
     depth = 0
-    in_str = False
-    esc = False
-    started = False
     buf = []
-    for ch in s:
-        if in_str:
-            buf.append(ch)
-            if esc: 
-                esc = False
-            elif ch == '\\': 
-                esc = True
-            elif ch == '"': 
-                in_str = False
+    for m in _CHUNK_RE.finditer(s):
+        tok = m.group(0)
+        if not buf:
+            if tok == '{':
+                # antes do 1º '{' só os literais string entram no buffer
+                buf.extend(x.group(0) for x in _STRING_RE.finditer(s, 0, m.start()))
+                buf.append(tok)
+                depth = 1
             continue
-        if ch == '"':
-            in_str = True
-            buf.append(ch)
-            continue
-        if ch == '{':
+        buf.append(tok)
+        if tok == '{':
             depth += 1
-            started = True
-            buf.append(ch)
-            continue
-        if ch == '}':
-            if started:
-                depth -= 1
-                buf.append(ch)
-                if depth == 0:
-                    return ''.join(buf)
-                continue
-        if started:
-            buf.append(ch)
+        elif tok == '}':
+            depth -= 1
+            if depth == 0:
+                return ''.join(buf)
     raise ValueError("No balanced JSON object found")
 
-def safe_json_loads(text: Union[str, bytes, Dict[str, Any]]) -> Dict[str, Any]:
+def _repair_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool de processos do caminho lento, criado sob demanda; None = reparo inline."""
+    global _REPAIR_POOL, _REPAIR_POOL_DISABLED, _REPAIR_POOL_PID
+    if settings.JSON_REPAIR_WORKERS <= 0 or _REPAIR_POOL_DISABLED:
+        return None
+    if _REPAIR_POOL is None or _REPAIR_POOL_PID != os.getpid():
+        with _REPAIR_POOL_LOCK:
+            if _REPAIR_POOL_PID != os.getpid():
+                _REPAIR_POOL = None
+            if _REPAIR_POOL is None and not _REPAIR_POOL_DISABLED:
+                # processo daemônico (worker prefork do Celery) não pode ter filhos
+                if multiprocessing.current_process().daemon:
+                    logger.warning("JSON_REPAIR_WORKERS ignorado em processo daemônico; reparo inline.")
+                    _REPAIR_POOL_DISABLED = True
+                    return None
+                try:
+                    _REPAIR_POOL = ProcessPoolExecutor(max_workers=settings.JSON_REPAIR_WORKERS)
+                    _REPAIR_POOL_PID = os.getpid()
+                except (OSError, ValueError, RuntimeError) as e:
+                    logger.warning("Pool de reparo de JSON indisponível (%s); reparo inline.", e)
+                    _REPAIR_POOL_DISABLED = True
+                    return None
+    return _REPAIR_POOL
+
+def _disable_repair_pool(e: BaseException) -> None:
+    """Pool quebrado/sem poder criar filhos: desliga de vez e segue inline."""
+    global _REPAIR_POOL, _REPAIR_POOL_DISABLED
+    logger.warning("Pool de reparo de JSON falhou (%r); seguindo com reparo inline.", e)
+    with _REPAIR_POOL_LOCK:
+        _REPAIR_POOL_DISABLED = True
+        pool, _REPAIR_POOL = _REPAIR_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _repair_and_load(s: str) -> Any:
+    # 2) reparos leves
+    s2 = _repair(s)
+    try:
+        return _loads(s2)
+    except Exception:
+        pass
+
+    # 3) fallback: primeiro objeto balanceado
+    cand = _extract_first_balanced_json(s2)
+    return _loads(cand)
+
+def _prepare(text: Union[str, bytes, Dict[str, Any]]) -> Tuple[bool, Any]:
+    """Passo 1 (sem reparo): (True, resultado) se resolveu; (False, texto limpo) se precisa reparar."""
     if isinstance(text, dict):
-        return text
+        return True, text
     if isinstance(text, bytes):
         text = text.decode("utf-8", "replace")
     if not isinstance(text, str):
         logger.error("safe_json_loads recebeu %s", type(text))
-        return {}
+        return True, {}
 
     s = _strip_code_fences(text)
 
     # 1) tentativa direta
     try:
-        return json.loads(s)
+        return True, _loads(s)
     except Exception:
         pass
+    return False, s
 
-    # 2) reparos leves
-    s2 = _fix_trailing_commas(s)
-    s2 = _drop_stray_closing_brace_at_level1(s2)
-    s2 = _escape_newlines_inside_strings(s2)
-    try:
-        return json.loads(s2)
-    except Exception:
-        pass
+def safe_json_loads(text: Union[str, bytes, Dict[str, Any]]) -> Dict[str, Any]:
+    done, s = _prepare(text)
+    if done:
+        return s
 
-    # 3) fallback: primeiro objeto balanceado
+    # 2/3) reparos: CPU pura, vai p/ o pool de processos (fora do GIL) quando habilitado
     try:
-        cand = _extract_first_balanced_json(s2)
-        return json.loads(cand)
+        pool = _repair_pool()
+        if pool is not None:
+            try:
+                return pool.submit(_repair_and_load, s).result()
+            except (BrokenProcessPool, AssertionError) as e:
+                _disable_repair_pool(e)
+        return _repair_and_load(s)
     except Exception as e:
         logger.error("Falha ao reparar JSON: %s", e)
         raise
 
+async def safe_json_loads_async(text: Union[str, bytes, Dict[str, Any]]) -> Dict[str, Any]:
+    """Igual a safe_json_loads, mas o reparo no pool não bloqueia o event loop."""
+    done, s = _prepare(text)
+    if done:
+        return s
 
+    try:
+        pool = _repair_pool()
+        if pool is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(pool, _repair_and_load, s)
+            except (BrokenProcessPool, AssertionError) as e:
+                _disable_repair_pool(e)
+        return _repair_and_load(s)
+    except Exception as e:
+        logger.error("Falha ao reparar JSON: %s", e)
+        raise
@@ -1,17 +1,25 @@
+import heapq
+import re
+from operator import itemgetter
 from typing import List, Dict, Any
 
+_BY_DATA = itemgetter("data")
+# Movimento com cara de decisão: uma busca case-insensitive pré-compilada, sem alocar desc.upper()
+_DECISAO_RE = re.compile("|".join(map(re.escape, ["DECIS", "DESPACHO"])), re.IGNORECASE)
+
 def build_timeline(tramitacao_atual: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Constrói uma timeline determinística a partir de 'movimentos' e 'documentos'.
     Cada item: {"data": "YYYY-MM-DD", "descricao": "...", "tipo": "MOVIMENTO|DECISAO|JUNTADA", "doc_ref": str|None}
     """
-    tl: List[Dict[str, Any]] = []
+    movs: List[Dict[str, Any]] = []
+    docs: List[Dict[str, Any]] = []
 
     # Movimentos
     for mov in tramitacao_atual.get("movimentos", []) or []:
         desc = (mov.get("descricao") or "").strip()
-        tipo = "DECISAO" if any(k in desc.upper() for k in ["DECIS", "DESPACHO"]) else "MOVIMENTO"
-        tl.append({
+        tipo = "DECISAO" if _DECISAO_RE.search(desc) else "MOVIMENTO"
+        movs.append({
             "data": (mov.get("dataHora") or "")[:10],
             "descricao": desc,
             "tipo": tipo,
@@ -22,15 +30,18 @@ def build_timeline(tramitacao_atual: Dict[str, Any]) -> List[Dict[str, Any]]:
     for doc in tramitacao_atual.get("documentos", []) or []:
         tipo_doc = (doc.get("tipo", {}) or {}).get("nome") or (doc.get("tipo", {}) or {}).get("codigo") or "DOC"
         nome = doc.get("nome") or str(doc.get("idCodex") or "")
-        tl.append({
+        docs.append({
             "data": (doc.get("dataHoraJuntada") or "")[:10],
             "descricao": f"Juntada: {tipo_doc} - {nome}",
             "tipo": "JUNTADA",
             "doc_ref": nome or str(doc.get("idCodex") or "")
         })
 
-    tl.sort(key=lambda x: x["data"] or "")
-    return tl
+    # Cada fonte já vem (quase) ordenada do Jus.br: ordena em separado (Timsort ~O(n)) e intercala.
+    # merge é estável como o sort antigo: em datas iguais, movimentos antes de juntadas.
+    movs.sort(key=_BY_DATA)
+    docs.sort(key=_BY_DATA)
+    return list(heapq.merge(movs, docs, key=_BY_DATA))
 
 
 def build_evidence_index(root: dict) -> dict:
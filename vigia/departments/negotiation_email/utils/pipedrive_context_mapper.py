@@ -1,18 +1,19 @@
 
+from types import MappingProxyType
 from typing import Dict, Any
 
-# Mapeamento de ID para Nome do Pipeline
-PIPELINE_MAP = {
+# Mapeamento de ID para Nome do Pipeline (somente leitura)
+PIPELINE_MAP = MappingProxyType({
     9: "Trabalhista - Localização",
     10: "Trabalhista - Negociação",
     12: "1-INDENIZATÓRIA - ANÁLISE",
     13: "2-INDENIZATÓRIA - NEGOCIAÇÃO",
     15: "0-INDENIZATORIA - FORA DA BASE",
     16: "4-INDENIZATORIA_FECHAMENTO"
-}
+})
 
-# Mapeamento de ID para Nome do Stage
-STAGE_MAP = {
+# Mapeamento de ID para Nome do Stage (somente leitura)
+STAGE_MAP = MappingProxyType({
     92: "Não localizado",
     93: "Localizado/Solicitado cálculo",
     96: "Em Negociação",
@@ -48,7 +49,7 @@ STAGE_MAP = {
     
     149: "INICIAR NEGOCIAÇÃO",
     150: "ENVIADO E-MAIL"
-}
+})
 
 CUSTOM_FIELD_KEYS = {
     "valor_do_acordo": "4227f47064ecbd933c9452f49feea489a04d43e1"
@@ -62,15 +63,14 @@ def enrich_deal_with_context(deal_details: Dict[str, Any]) -> Dict[str, Any]:
     if not deal_details:
         return {}
 
-    pipeline_id = deal_details.get("pipeline_id")
-    stage_id = deal_details.get("stage_id")
-
-    # Adiciona o nome do pipeline, se o ID for encontrado no mapa
-    if pipeline_id in PIPELINE_MAP:
-        deal_details["pipeline_name"] = PIPELINE_MAP[pipeline_id]
+    # Adiciona o nome do pipeline, se o ID for encontrado no mapa (uma consulta só)
+    pipeline_name = PIPELINE_MAP.get(deal_details.get("pipeline_id"))
+    if pipeline_name is not None:
+        deal_details["pipeline_name"] = pipeline_name
 
     # Adiciona o nome do stage, se o ID for encontrado no mapa
-    if stage_id in STAGE_MAP:
-        deal_details["stage_name"] = STAGE_MAP[stage_id]
+    stage_name = STAGE_MAP.get(deal_details.get("stage_id"))
+    if stage_name is not None:
+        deal_details["stage_name"] = stage_name
 
     return deal_details
\ No newline at end of file
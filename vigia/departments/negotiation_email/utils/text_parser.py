@@ -1,19 +1,45 @@
 from bs4 import BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser  # selectolax (opcional, parser em C)
+except ImportError:
+    LexborHTMLParser = None
+
+
+def _clean_with_lexbor(html_string: str) -> str:
+    tree = LexborHTMLParser(html_string)
+    for element in tree.css("script, style"):
+        element.decompose()
+    if tree.root is None:
+        return ""
+    # separador neutro p/ descartar nós só de espaço, como o get_text(strip=True) do bs4
+    parts = tree.root.text(separator="\x00", strip=True).split("\x00")
+    return " ".join(p for p in parts if p)
+
 
 def clean_html_body(html_string: str) -> str:
     """
-    Usa BeautifulSoup para limpar uma string HTML de um corpo de e-mail.
-    
+    Limpa uma string HTML de um corpo de e-mail (selectolax quando disponível, senão BeautifulSoup).
+
     - Remove tags de script e estilo.
     - Extrai apenas o texto visível.
     - Junta as linhas de texto de forma inteligente para preservar a legibilidade.
-    
+
     Returns:
         Uma string com o texto limpo e legível.
     """
     if not html_string:
         return ""
 
+    # texto puro (sem tags nem entidades): nada a parsear
+    if "<" not in html_string and "&" not in html_string:
+        return html_string.strip()
+
+    if LexborHTMLParser is not None:
+        try:
+            return _clean_with_lexbor(html_string)
+        except Exception:
+            pass  # entradas patológicas: tenta o bs4
+
     try:
         soup = BeautifulSoup(html_string, 'html.parser')
 
@@ -21,8 +47,8 @@ def clean_html_body(html_string: str) -> str:
             element.decompose()
 
         text = soup.get_text(separator=' ', strip=True)
-        
+
         return text
     except Exception as e:
         print(f"Alerta: Falha ao fazer o parsing do HTML. Retornando conteúdo bruto. Erro: {e}")
-        return html_string
\ No newline at end of file
+        return html_string
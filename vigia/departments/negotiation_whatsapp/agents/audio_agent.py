@@ -1,6 +1,16 @@
+import json
+import re
+
 from .specialist_agents import ExtractorAgent
 from vigia.services import llm_service
 
+# "[ÁUDIO CONFIDÊNCIA=0.87]: texto" (whisper) / "... BAIXA]: texto" (importador, conf < limiar)
+_AUDIO_RE = re.compile(
+    r"^\[ÁUDIO CONFIDÊNCIA=\d+(?:[.,]\d+)?(?P<baixa> BAIXA)?\]:\s*(?P<body>.*)$", re.S
+)
+# transcrições confiáveis até este tamanho dispensam o LLM
+_AUDIO_FAST_MAX_CHARS = 600
+
 _AUDIO_TOT_GUIDELINES = """
 DIRETRIZES ÁUDIO (Tree-of-Thought + Confidence):
 ● Mensagens de áudio chegam como [ÁUDIO …].
@@ -20,6 +30,8 @@ AUDIO_JSON_SCHEMA = """
 """
 
 class AudioTOTAgent(ExtractorAgent):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(system_prompt=f"""
 Você é um agente especialista em transcrição e interpretação de mensagens de voz em negociações.
@@ -33,7 +45,17 @@ Schema:
     async def execute(self, audio_payload: str, current_date: str) -> str:
         """
         Recebe SOMENTE o trecho “[ÁUDIO …] …” e devolve JSON com transcrição limpa.
+        Áudio com confiança normal e texto curto é resolvido sem LLM; o resto vai ao modelo.
         """
+        m = _AUDIO_RE.match(audio_payload.strip())
+        if m and not m.group("baixa"):
+            body = m.group("body").strip()
+            if body and len(body) <= _AUDIO_FAST_MAX_CHARS:
+                return json.dumps(
+                    {"transcricao_limpa": body, "possui_baixa_confianca": False},
+                    ensure_ascii=False,
+                )
+
         user_prompt = f"""
         Considere que a data de hoje é {current_date}.
         A seguir, o conteúdo bruto do áudio:
@@ -42,6 +64,6 @@ Schema:
         ---
         Forneça o JSON solicitado, sem texto extra.
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        return await llm_service.llm_call(self.system_prompt, user_prompt, expects_json=True)
 
 audio_tot_agent = AudioTOTAgent()
@@ -1,24 +1,78 @@
+import asyncio
+import io
 import logging
-from typing import Dict, Any
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
 
+from vigia.config import settings
 from vigia.services import pipedrive_service
 from vigia.services.pipedrive_service import whatsapp_client
 
+# Cache TTL de consultas ao Pipedrive: (tipo, chave) -> (expira_em, valor)
+_CACHE: Dict[Tuple[str, Hashable], Tuple[float, Any]] = {}
+_CACHE_LOCKS: Dict[Tuple[str, Hashable], asyncio.Lock] = {}
+_CACHE_MAX = 1024
+
+
+def _cache_get(ck: Tuple[str, Hashable]) -> Optional[Any]:
+    hit = _CACHE.get(ck)
+    if hit is not None and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+async def _cached(kind: str, key: Hashable, fetch: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+    """Memoiza `fetch()` por PIPEDRIVE_CACHE_TTL_SECONDS; misses concorrentes da mesma chave viram uma chamada só."""
+    if key is None or key == "":
+        # chave vazia (ex.: JID sem dígitos) juntaria conversas distintas numa só entrada
+        return await fetch()
+    ck = (kind, key)
+    value = _cache_get(ck)
+    if value is not None:
+        return value
+
+    lock = _CACHE_LOCKS.setdefault(ck, asyncio.Lock())
+    async with lock:
+        value = _cache_get(ck)
+        if value is None:
+            value = await fetch()
+            if value is not None:  # "não encontrado" não é cacheado
+                now = time.monotonic()
+                _CACHE.pop(ck, None)  # reinserção vai para o fim (ordem = idade)
+                if len(_CACHE) >= _CACHE_MAX:
+                    for k in [k for k, (exp, _) in _CACHE.items() if exp <= now]:
+                        del _CACHE[k]
+                    # todas vivas: descarta as mais antigas (dict preserva a ordem de inserção)
+                    while len(_CACHE) >= _CACHE_MAX:
+                        del _CACHE[next(iter(_CACHE))]
+                _CACHE[ck] = (now + settings.PIPEDRIVE_CACHE_TTL_SECONDS, value)
+    if not lock.locked():
+        _CACHE_LOCKS.pop(ck, None)
+    return value
+
 class PipedriveDataMinerAgent:
     """
     Agente Gerador para WhatsApp: Busca os dados mais ricos possíveis a partir de um telefone.
     """
     async def execute(self, conversation_jid: str) -> Dict[str, Any]:
-        phone_number = conversation_jid.split('@')[0]
+        phone_number = conversation_jid.split('@', 1)[0]
         logging.info(f"Minerador (WhatsApp): Buscando dados para {phone_number}...")
 
-        person_details = await pipedrive_service.find_person_by_phone(whatsapp_client, phone_number)
+        # chave normalizada: variações de formato do mesmo número caem na mesma entrada
+        # (a busca recebe o número cru; find_person_by_phone normaliza por conta própria)
+        person_details = await _cached(
+            "person", pipedrive_service.phone_from_jid(conversation_jid),
+            lambda: pipedrive_service.find_person_by_phone(whatsapp_client, phone_number),
+        )
         
         if not person_details:
             return {"person": None, "deal": None}
 
         person_id = person_details.get("id")
-        deal_details = await pipedrive_service.find_deals_by_person_id(whatsapp_client, person_id)
+        deal_details = await _cached(
+            "deal", person_id,
+            lambda: pipedrive_service.find_deals_by_person_id(whatsapp_client, person_id),
+        )
         
         return {"person": person_details, "deal": deal_details}
 
@@ -35,32 +89,37 @@ class ContextSynthesizerAgent:
             return "Nenhum contexto encontrado no Pipedrive."
 
         person_name = person.get("name", "N/A")
-        context_parts = [f"**Contexto do CRM (Pipedrive) para {person_name}**"]
-        
-        context_parts.append(f"- **Pessoa:** {person_name} (ID: {person.get('id')})")
+        # um único buffer em vez de lista de partes + join
+        buf = io.StringIO()
+        w = buf.write
+        w(f"**Contexto do CRM (Pipedrive) para {person_name}**")
+        w(f"\n- **Pessoa:** {person_name} (ID: {person.get('id')})")
         if person.get("owner_name"):
-            context_parts.append(f"  - Responsável pela Pessoa: {person.get('owner_name')}")
-        if person.get("emails"):
-            context_parts.append(f"  - E-mails: {', '.join(person['emails'])}")
-        
+            w(f"\n  - Responsável pela Pessoa: {person['owner_name']}")
+        emails = person.get("emails")
+        if emails:
+            w("\n  - E-mails: ")
+            w(emails[0] if len(emails) == 1 else ", ".join(emails))
+
         if deal:
-            context_parts.append(f"- **Negócio:** '{deal.get('title')}' (ID: {deal.get('id')})")
+            w(f"\n- **Negócio:** '{deal.get('title')}' (ID: {deal.get('id')})")
             if deal.get("owner_name"):
-                context_parts.append(f"  - Responsável pelo Negócio: {deal.get('owner_name')}")
-            context_parts.append(f"  - Status: **{deal.get('status', 'N/A').upper()}**")
-            context_parts.append(f"  - Valor: {deal.get('formatted_value', 'N/A')}")
+                w(f"\n  - Responsável pelo Negócio: {deal['owner_name']}")
+            w(f"\n  - Status: **{deal.get('status', 'N/A').upper()}**")
+            w(f"\n  - Valor: {deal.get('formatted_value', 'N/A')}")
             if deal.get("won_time"):
-                context_parts.append(f"  - Data de Sucesso: {deal['won_time']}")
+                w(f"\n  - Data de Sucesso: {deal['won_time']}")
             if deal.get("next_activity_subject"):
-                context_parts.append(f"  - Próxima Atividade: '{deal['next_activity_subject']}' em {deal.get('next_activity_date', 'N/A')}")
-            if deal.get('notes'):
-                notes_str = " | ".join(deal['notes'])
-                context_parts.append(f"  - Notas Importantes: {notes_str}")
+                w(f"\n  - Próxima Atividade: '{deal['next_activity_subject']}' em {deal.get('next_activity_date', 'N/A')}")
+            notes = deal.get("notes")
+            if notes:
+                w("\n  - Notas Importantes: ")
+                w(" | ".join(notes))
         else:
-            context_parts.append("- **Negócio:** Nenhum negócio associado foi encontrado.")
-        
+            w("\n- **Negócio:** Nenhum negócio associado foi encontrado.")
+
         logging.info("Síntese de contexto aprimorada concluída.")
-        return "\n".join(context_parts)
+        return buf.getvalue()
 
 data_miner_agent = PipedriveDataMinerAgent()
 context_synthesizer_agent = ContextSynthesizerAgent()
\ No newline at end of file
@@ -59,7 +59,7 @@ class BusinessDirectorAgent:
         data_follow_up = prazos.get("data_follow_up_agendada")
 
         resumo_negociacao = conversation_data.get("resumo_negociacao")
-        telefone_contato = conversation_id.split('@')[0]
+        telefone_contato = conversation_id.split('@', 1)[0]
 
         user_prompt = f"""
         A data de hoje é {datetime.now().strftime('%Y-%m-%d')}.
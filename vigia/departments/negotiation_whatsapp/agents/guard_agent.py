@@ -1,6 +1,8 @@
 from vigia.services import llm_service
 
 class PromptGuardAgent:
+    __slots__ = ("system_prompt",)
+
     def __init__(self):
         self.system_prompt = """
         Você é um autômato lógico, um Auditor de Conformidade de IA. Sua única tarefa é verificar se uma
@@ -51,6 +53,9 @@ class PromptGuardAgent:
             ]
           }}
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        # auditoria determinística de formato: mesma entrada, mesma resposta → cacheável
+        return await llm_service.llm_call(
+            self.system_prompt, user_prompt, expects_json=True, use_cache=True
+        )
 
 guard_agent = PromptGuardAgent()
\ No newline at end of file
@@ -1,6 +1,18 @@
 from vigia.services import llm_service
 
+MANAGER_OUTPUT_SCHEMA = '{"resumo_negociacao": "...", "status": "...", "valores": {}, "prazos": {"data_proposta_cliente": null, "data_final_acordada_absoluta": null, "data_follow_up_agendada": null}, "objeto_negociacao": "...", "pontos_chave_cliente": []}'
+
+# Regras de formato da saída do gerente (o que o guard audita), sem o histórico da conversa
+MANAGER_OUTPUT_RULES = f"""
+Responda APENAS com o objeto JSON final, sem texto adicional.
+A resposta deve ser um único e bem formatado objeto JSON, seguindo o schema abaixo.
+Schema JSON de Saída:
+{MANAGER_OUTPUT_SCHEMA}
+"""
+
 class ValidationManagerAgent:
+    __slots__ = ("system_prompt",)
+
     def __init__(self):
         self.system_prompt = """
         Você é um gerente de análise de negociações sênior, um mestre em lógica,
@@ -41,8 +53,8 @@ class ValidationManagerAgent:
         4.  **Formato:** Sua resposta final deve ser um único e bem formatado objeto JSON, seguindo o schema abaixo.
 
         **Schema JSON de Saída:**
-        {{"resumo_negociacao": "...", "status": "...", "valores": {{}}, "prazos": {{"data_proposta_cliente": null, "data_final_acordada_absoluta": null, "data_follow_up_agendada": null}}, "objeto_negociacao": "...", "pontos_chave_cliente": []}}
+        {MANAGER_OUTPUT_SCHEMA}
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        return await llm_service.llm_call(self.system_prompt, user_prompt, expects_json=True)
 
 manager_agent = ValidationManagerAgent()
\ No newline at end of file
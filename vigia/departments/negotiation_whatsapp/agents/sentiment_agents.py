@@ -15,7 +15,7 @@ class SentimentAnalysisAgent:
 
         Sua Análise de Sentimento:
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        return await llm_service.llm_call(self.system_prompt, user_prompt, expects_json=True)
 
 # FUNCIONÁRIO 1: O Analista Lexical
 lexical_sentiment_agent = SentimentAnalysisAgent(
@@ -64,6 +64,6 @@ class SentimentManagerAgent:
         Responda com um JSON contendo 'temperatura_final', 'tendencia' e 'justificativa_final'.
         Exemplo: {{"temperatura_final": "Positivo", "tendencia": "melhorando", "justificativa_final": "A conversa começou tensa, mas o cliente aceitou o acordo de forma cordial."}}
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        return await llm_service.llm_call(self.system_prompt, user_prompt, expects_json=True)
 
 sentiment_manager_agent = SentimentManagerAgent()
\ No newline at end of file
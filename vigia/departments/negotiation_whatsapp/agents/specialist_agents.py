@@ -1,6 +1,10 @@
+import json
+
 from vigia.services import llm_service
 
 class ExtractorAgent:
+    __slots__ = ("system_prompt",)
+
     def __init__(self, system_prompt: str):
         self.system_prompt = system_prompt
 
@@ -17,28 +21,31 @@ class ExtractorAgent:
         {conversation_history}
         ---
         """
-        return await llm_service.llm_call(self.system_prompt, user_prompt)
+        return await llm_service.llm_call(self.system_prompt, user_prompt, expects_json=True)
 
-# Schema JSON mais flexível e descritivo
+# Schema JSON mais flexível e descritivo (chaves simples: entra por interpolação, não é template)
 JSON_SCHEMA = """
-{{
+{
     "resumo_negociacao": "Um resumo conciso de toda a negociação até o momento.",
     "status": "O status atual da negociação (ex: 'Contato Inicial', 'Em Negociação', 'Aguardando Retorno do Cliente', 'Acordo Fechado').",
-    "valores": {{
+    "valores": {
         "descricao": "Opcional. Uma descrição do valor principal em negociação.",
         "valor_total": "Opcional. O valor numérico principal da dívida ou proposta."
-    }},
-    "prazos": {{
+    },
+    "prazos": {
         "data_proposta_cliente": "Opcional. A data em que o cliente propôs algo, em formato AAAA-MM-DD.",
         "data_final_acordada_absoluta": "Opcional. A data final acordada para um pagamento, em formato AAAA-MM-DD.",
         "data_follow_up_agendada": "Opcional. A data agendada para um próximo contato, em formato AAAA-MM-DD."
-    }},
+    },
     "objeto_negociacao": "O que está sendo negociado (ex: 'Ressarcimento de danos', 'Quitação de débito').",
     "pontos_chave_cliente": [
         "Uma lista de argumentos, dúvidas ou pontos importantes levantados pelo CLIENTE."
     ]
-}}
+}
 """
+# chaves de topo do schema e o tipo esperado dos campos compostos (validação estrutural sem LLM)
+JSON_SCHEMA_KEYS = frozenset(json.loads(JSON_SCHEMA))
+JSON_SCHEMA_TYPES = {"valores": dict, "prazos": dict, "pontos_chave_cliente": list}
 
 cautious_agent = ExtractorAgent(
     system_prompt=f"""
@@ -5,6 +5,8 @@ import re
 from datetime import datetime
 from typing import Any, Dict, Optional, Tuple
 
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import Session
 
 from db import models
@@ -16,46 +18,113 @@ from ..agents import context_agent, specialist_agents
 from ..agents.audio_agent import audio_tot_agent
 from ..agents.director_agent import director_agent
 from ..agents.guard_agent import guard_agent
-from ..agents.manager_agent import manager_agent
+from ..agents.manager_agent import MANAGER_OUTPUT_RULES, manager_agent
 from ..agents.sentiment_agents import (
     behavioral_sentiment_agent,
     lexical_sentiment_agent,
     sentiment_manager_agent,
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 AUDIO_RE = re.compile(r":\s*\[ÁUDIO", re.I)
 
 
+def _json_loads(s: str) -> Any:
+    """orjson quando disponível (erros dele também são json.JSONDecodeError); senão o stdlib."""
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
+
+def _schema_compliant_data(output: str) -> Optional[dict]:
+    """
+    Checagem determinística das regras de formato do extrator: só um objeto JSON com as chaves do schema.
+    Devolve o objeto já decodificado (reaproveitado pelo chamador) ou None se não passar.
+    """
+    text = output.strip() if isinstance(output, str) else ""
+    if not (text.startswith("{") and text.endswith("}")):
+        return None
+    try:
+        data = _json_loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or data.keys() != specialist_agents.JSON_SCHEMA_KEYS:
+        return None
+    if all(
+        data[key] is None or isinstance(data[key], kind)
+        for key, kind in specialist_agents.JSON_SCHEMA_TYPES.items()
+    ):
+        return data
+    return None
+
+
+async def _run_guard(
+    original_prompt: str, agent_output: str
+) -> Tuple[Optional[dict], Any]:
+    """
+    Devolve (saída decodificada ou None, relatório do guard).
+    Estrutura válida já prova a conformidade (relatório OK como dict); o guard (LLM) só
+    explica as falhas e devolve a string crua. Repetições idênticas saem do cache do llm_call.
+    """
+    data = _schema_compliant_data(agent_output)
+    if data is not None:
+        return data, {"compliance_status": "OK", "detalhes": []}
+    return None, await guard_agent.execute(original_prompt, agent_output)
+
+
+def _as_json(value: Any) -> Any:
+    return value if isinstance(value, dict) else _json_loads(value)
+
+
+def _format_audio_line(line: str, sender: str, raw_result: str) -> str:
+    cleaned = llm_service._clean_llm_response(raw_result)
+    try:
+        info = _json_loads(cleaned)
+    except json.JSONDecodeError:
+        logging.error(f"AudioTOTAgent JSON inválido: {cleaned}")
+        return line
+
+    tag = " (BAIXA CONFIANÇA)" if info.get("possui_baixa_confianca") else ""
+    transcricao = info.get("transcricao_limpa", "")
+    return f"{sender}: [TRANSCRIÇÃO ÁUDIO{tag}]: {transcricao}"
+
+
 async def _preprocess_audio_segments(raw_history: str, reference_date: str) -> str:
-    processed_lines = []
+    lines = raw_history.splitlines()
+    audio_indices = []
+    senders = []
+    payloads = []
 
-    for line in raw_history.splitlines():
+    for idx, line in enumerate(lines):
         if AUDIO_RE.search(line):
             # ── separa remetente do payload ──────────────────────────────
             sender, _, payload = line.partition(":")  # "Cliente", "[ÁUDIO…"
-            payload = payload.strip()
-
-            # ── chama o agente TOT só com o payload ─────────────────────
-            raw_result = await audio_tot_agent.execute(payload, reference_date)
-            cleaned = llm_service._clean_llm_response(raw_result)
+            audio_indices.append(idx)
+            senders.append(sender)
+            payloads.append(payload.strip())
 
-            try:
-                info = json.loads(cleaned)
-            except json.JSONDecodeError:
-                logging.error(f"AudioTOTAgent JSON inválido: {cleaned}")
-                processed_lines.append(line)
-                continue
+    if not payloads:
+        return "\n".join(lines)
 
-            tag = " (BAIXA CONFIANÇA)" if info.get("possui_baixa_confianca") else ""
-            transcricao = info.get("transcricao_limpa", "")
+    # ── agente TOT só com o payload, todos os áudios em paralelo ────────
+    # (a concorrência global fica a cargo do semáforo do llm_service)
+    results = await asyncio.gather(
+        *(audio_tot_agent.execute(payload, reference_date) for payload in payloads)
+    )
 
-            processed_lines.append(f"{sender}: [TRANSCRIÇÃO ÁUDIO{tag}]: {transcricao}")
-        else:
-            processed_lines.append(line)
+    for idx, sender, raw_result in zip(audio_indices, senders, results):
+        lines[idx] = _format_audio_line(lines[idx], sender, raw_result)
 
-    return "\n".join(processed_lines)
+    return "\n".join(lines)
 
 
 async def _run_guarded_specialist(
@@ -69,11 +138,13 @@ async def _run_guarded_specialist(
         history_with_context, reference_date
     )
 
-    # 2. Chama o PromptGuardAgent para validar a saída
-    compliance_report_str = await guard_agent.execute(
-        original_prompt=specialist_agent.system_prompt, agent_output=raw_output_str
+    # 2. Chama o PromptGuardAgent para validar a saída (no caminho feliz, já decodificada)
+    output_data, compliance_report = await _run_guard(
+        specialist_agent.system_prompt, raw_output_str
     )
-    compliance_report = json.loads(compliance_report_str)
+    if output_data is not None:
+        return output_data
+    compliance_report = _json_loads(compliance_report)
 
     # 3. Verifica o resultado da validação
     if compliance_report.get("compliance_status") == "FALHA":
@@ -87,7 +158,7 @@ async def _run_guarded_specialist(
     try:
         # Re-usa a função de limpeza que já tínhamos para garantir que é um JSON puro
         cleaned_json_str = llm_service._clean_llm_response(raw_output_str)
-        return json.loads(cleaned_json_str)
+        return _json_loads(cleaned_json_str)
     except json.JSONDecodeError:
         logging.error(
             f"Mesmo passando na conformidade, a saída do agente {type(specialist_agent).__name__} não é um JSON válido: {raw_output_str}"
@@ -100,19 +171,42 @@ def fetch_history_and_date_from_db(
 ) -> Tuple[str, datetime]:
     """Busca o histórico e a data da ÚLTIMA mensagem de uma conversa no banco."""
     logging.info(f"Buscando histórico e data do DB para: {conversation_jid}")
-    messages = (
-        db.query(models.WhatsappMessage)
+    # o Postgres monta o histórico (string_agg ordenado) e a última data: uma linha só volta,
+    # sem hidratar entidades ORM (índice ix_wpp_msg_conv_ts cobre a ordenação)
+    msg = models.WhatsappMessage
+    line = func.concat(msg.sender, ": ", func.coalesce(msg.text, ""))
+    stmt = (
+        select(
+            func.string_agg(
+                line, aggregate_order_by(literal("\n"), msg.message_timestamp.asc())
+            ).label("history"),
+            func.max(msg.message_timestamp).label("last_ts"),
+        )
         .join(models.WhatsappConversation)
-        .filter(models.WhatsappConversation.remote_jid == conversation_jid)
-        .order_by(models.WhatsappMessage.message_timestamp.asc())
-        .all()
+        .where(models.WhatsappConversation.remote_jid == conversation_jid)
     )
-    if not messages:
+    row = db.execute(stmt).one()
+    if not row.history:
         return "", None
 
-    history_text = "\n".join([f"{msg.sender}: {msg.text}" for msg in messages])
-    last_message_date = messages[-1].message_timestamp
-    return history_text, last_message_date
+    return row.history, row.last_ts
+
+
+def _fetch_history_sync(conversation_jid: str) -> Tuple[str, datetime]:
+    with SessionLocal() as db:
+        return fetch_history_and_date_from_db(db, conversation_jid)
+
+
+def _save_results_sync(
+    conversation_jid: str, full_report: dict, instance_name: Optional[str]
+) -> None:
+    with SessionLocal() as db:
+        database_service.save_whatsapp_analysis_results(
+            db=db,
+            conversation_jid=conversation_jid,
+            analysis_data=full_report,
+            instance_name=instance_name,
+        )
 
 
 async def run_context_department(conversation_jid: str) -> str:
@@ -221,45 +315,53 @@ async def run_department_pipeline(payload: dict) -> Optional[Dict[str, Any]]:
         f"PIPELINE WHATSAPP: Iniciando ciclo de análise para: {conversation_jid}"
     )
 
-    db = SessionLocal()
+    # Contexto do CRM (Pipedrive) só depende do JID: corre enquanto o histórico
+    # é lido (DB, fora do event loop) e os áudios são transcritos
+    context_task = asyncio.create_task(run_context_department(conversation_jid))
     try:
-        history_text, last_message_date = fetch_history_and_date_from_db(
-            db, conversation_jid
+        history_text, last_message_date = await asyncio.to_thread(
+            _fetch_history_sync, conversation_jid
         )
         if not history_text:
             logging.warning(
                 f"Não foi possível encontrar histórico para {conversation_jid} no banco."
             )
+            context_task.cancel()
             return None
-    finally:
-        db.close()
 
-    reference_date_str = (
-        last_message_date.strftime("%Y-%m-%d")
-        if last_message_date
-        else datetime.now().strftime("%Y-%m-%d")
-    )
+        reference_date_str = (
+            last_message_date.strftime("%Y-%m-%d")
+            if last_message_date
+            else datetime.now().strftime("%Y-%m-%d")
+        )
+
+        # FASE 1: Contextualização
+        history_text = await _preprocess_audio_segments(history_text, reference_date_str)
+    except BaseException:
+        context_task.cancel()
+        raise
 
-    # FASE 1: Contextualização
-    history_text = await _preprocess_audio_segments(history_text, reference_date_str)
-    enriched_context = await run_context_department(conversation_jid)
+    # FASE 2: Execução Paralela — a temperatura usa só o histórico e não espera o contexto
+    temp_task = asyncio.create_task(run_temperature_department(history_text))
+    try:
+        enriched_context = await context_task
+    except BaseException:
+        temp_task.cancel()
+        raise
     history_with_context = (
         f"{enriched_context}\n\n---\n\nHISTÓRICO DA CONVERSA ORIGINAL:\n{history_text}"
     )
 
-    # FASE 2: Execução Paralela
-    department_reports = await asyncio.gather(
+    final_data_str, final_temp_str = await asyncio.gather(
         run_extraction_department(history_with_context, reference_date_str),
-        run_temperature_department(history_text),
+        temp_task,
     )
-    final_data_str, final_temp_str = department_reports
 
-    # FASE 3: Meta-Análise e Decisão Final
-    guard_report_str = await guard_agent.execute(
-        guard_agent.system_prompt, final_data_str
-    )
-    director_output_str = await director_agent.execute(
-        final_data_str, final_temp_str, conversation_jid
+    # FASE 3: Meta-Análise e Decisão Final (independentes entre si: em paralelo)
+    (final_data, guard_report), director_output_str = await asyncio.gather(
+        # o guard audita as regras de formato do gerente (quem produziu o relatório), não as próprias
+        _run_guard(MANAGER_OUTPUT_RULES, final_data_str),
+        director_agent.execute(final_data_str, final_temp_str, conversation_jid),
     )
 
     director_decision = {}
@@ -269,7 +371,7 @@ async def run_department_pipeline(payload: dict) -> Optional[Dict[str, Any]]:
             director_output = director_output_str
         else:
             # Se for uma string, tenta decodificar como JSON
-            director_output = json.loads(director_output_str)
+            director_output = _json_loads(director_output_str)
 
         if (
             isinstance(director_output, dict)
@@ -293,9 +395,12 @@ async def run_department_pipeline(payload: dict) -> Optional[Dict[str, Any]]:
     try:
         full_report = {
             "analysis_metadata": {"conversation_jid": conversation_jid},
-            "extracted_data": json.loads(final_data_str),
-            "temperature_analysis": json.loads(final_temp_str),
-            "guard_report": json.loads(guard_report_str),
+            # o que o guard já decodificou não é decodificado de novo
+            "extracted_data": (
+                final_data if final_data is not None else _json_loads(final_data_str)
+            ),
+            "temperature_analysis": _json_loads(final_temp_str),
+            "guard_report": _as_json(guard_report),
             "director_decision": director_decision,
             "context": {"crm_context": enriched_context},
         }
@@ -306,16 +411,16 @@ async def run_department_pipeline(payload: dict) -> Optional[Dict[str, Any]]:
         return None
 
     if save_result:
-        db = SessionLocal()
-        try:
-            database_service.save_whatsapp_analysis_results(
-                db=db, conversation_jid=conversation_jid, analysis_data=full_report
-            )
-            logging.info(
-                f"Análise da conversa {conversation_jid} foi salva/atualizada no banco."
-            )
-        finally:
-            db.close()
+        # upsert numa thread: o event loop segue livre e a task só termina após gravar
+        await asyncio.to_thread(
+            _save_results_sync,
+            conversation_jid,
+            full_report,
+            payload.get("instance_name"),
+        )
+        logging.info(
+            f"Análise da conversa {conversation_jid} foi salva/atualizada no banco."
+        )
 
     logging.info(
         f"PIPELINE WHATSAPP: Ciclo para a conversa {conversation_jid} finalizado."
@@ -22,11 +22,18 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from sqlalchemy import create_engine
+from psycopg2.extras import register_default_json
+from sqlalchemy import create_engine, event
 from sqlalchemy.pool import QueuePool
 import statsmodels.formula.api as smf
 from statsmodels.tools.sm_exceptions import PerfectSeparationError
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 warnings.filterwarnings("ignore", category=FutureWarning)
 locale.setlocale(locale.LC_ALL, "pt_BR.UTF-8")
 
@@ -70,10 +77,34 @@ def wrap_text(s: str, width: int = 60) -> str:
         return s
     return textwrap.shorten(s, width, placeholder="…")
 
+def _flatten_into(d: dict, prefix: str, out: dict, i: int, n: int) -> None:
+    """Achata `d` recursivamente em `out[f"{prefix}_{chave}"][i]` (listas ficam intactas)."""
+    for k, v in d.items():
+        key = f"{prefix}_{k}"
+        if isinstance(v, dict):
+            _flatten_into(v, key, out, i, n)
+            continue
+        col = out.get(key)
+        if col is None:
+            col = out[key] = [None] * n
+        col[i] = v
+
+def flatten_json_column(values, prefix: str) -> dict[str, list]:
+    """Equivalente a `pd.json_normalize(sep="_")` num único passe (dict de listas)."""
+    n = len(values)
+    out: dict[str, list] = {}
+    for i, raw in enumerate(values):
+        if isinstance(raw, dict):
+            _flatten_into(raw, prefix, out, i, n)
+    return out
+
 @st.cache_data(ttl=timedelta(minutes=5), show_spinner="🔄 Carregando dados…")
 def read_whatsapp_data() -> pd.DataFrame:
     """Consulta somente conversas de WhatsApp e faz o parsing/flatten."""
     engine = create_engine(DB_URI, poolclass=QueuePool, pool_size=3)
+    # json → dict direto no driver (orjson), sem re-parse por linha
+    event.listen(engine, "connect",
+                 lambda dbapi_conn, _: register_default_json(dbapi_conn, loads=_json_loads))
     sql = """
       SELECT a.id, a.analysable_id, c.remote_jid, a.created_at,
              a.extracted_data, a.temperature_assessment, a.director_decision
@@ -90,22 +121,12 @@ def read_whatsapp_data() -> pd.DataFrame:
     df["created_at"] = pd.to_datetime(df["created_at"])
 
     # ---- JSON → colunas ----
-    def _safe(x):
-        if isinstance(x, dict):
-            return x
-        if isinstance(x, str) and x.strip():
-            try:
-                return json.loads(x)
-            except json.JSONDecodeError:
-                return {}
-        return {}
     for col in JSON_COLUMNS:
         if col not in df:
             continue
-        flat = pd.json_normalize(df[col].apply(_safe), sep="_")
-        flat.columns = [f"{col.split('_')[0]}_{c}" for c in flat.columns]
+        flat = flatten_json_column(df[col].to_numpy(), col.split('_')[0])
         df.drop(columns=[col], inplace=True)
-        df = pd.concat([df, flat], axis=1)
+        df = pd.concat([df, pd.DataFrame(flat, index=df.index)], axis=1)
 
     # ---- valores financeiros ----
     orig_col = find_col(df, ["valores_valor_total", "valores_valor_original_divida"])
@@ -123,6 +144,11 @@ def read_whatsapp_data() -> pd.DataFrame:
     df["desconto_reais"] = df["valor_original"] - df["valor_final"]
     df["desconto_pct"]   = (df["desconto_reais"] / df["valor_original"] * 100
                             ).replace([np.inf, -np.inf], 0).fillna(0)
+
+    # texto → string[pyarrow]: o cache serializa buffers Arrow, não um str por célula
+    txt = [c for c in df.columns[df.dtypes == object]
+           if pd.api.types.infer_dtype(df[c], skipna=True) == "string"]
+    df[txt] = df[txt].astype("string[pyarrow]")
     return df
 
 def compound_growth(series: pd.Series, freq="D") -> float:
@@ -186,8 +212,7 @@ def tab_performance_kpis(df: pd.DataFrame):
 
     # ---------- agregação corrigida ----------
     ts = (
-        df.set_index("created_at")
-          .resample("D")
+        df.groupby(pd.Grouper(key="created_at", freq="D"))
           .agg(analises=("id", "count"),
                ia_sum=("_ia_flag", "sum"))
           .assign(taxa=lambda d: 100 * d.ia_sum / d.analises)
@@ -336,7 +361,7 @@ def tab_advanced_analytics(df: pd.DataFrame):
     st.divider()
     # ---------- Série Temporal ----------
     st.markdown("#### Volume Diário + CAGR")
-    ts = df.set_index("created_at").resample("D")["id"].count()
+    ts = df.groupby(pd.Grouper(key="created_at", freq="D"))["id"].count()
     if len(ts) >= 2:
         cagrd = compound_growth(ts)
         cagrm = compound_growth(ts.resample("M").sum(), "M")
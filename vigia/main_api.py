@@ -1,11 +1,13 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import BackgroundTasks, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from vigia.api.routers import auth, chat, cpj_data, negotiations, processes, system
 from vigia.api.routers.actions import negotiation_actions, process_actions
+from vigia.departments.negotiation_email.services import discord_notifier
 from vigia.utils.main_utils import normalize_chatwoot_payload
 
 from .config import settings
@@ -13,10 +15,19 @@ from .worker import process_conversation_task
 
 logging.basicConfig(level=settings.LOG_LEVEL)
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    # libera o pool HTTP compartilhado do webhook do Discord
+    await discord_notifier.aclose_client()
+
+
 app = FastAPI(
     title="Vigia API",
     description="API para o sistema de negociação e análise jurídica.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 WEBHOOK_SECRET = os.getenv("CHATWOOT_WEBHOOK_SECRET", "")
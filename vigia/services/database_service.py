@@ -1,6 +1,6 @@
 import logging
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import insert
@@ -120,48 +120,51 @@ def save_raw_conversation(
 
 
 def save_whatsapp_analysis_results(
-    db: Session, instance_name: str, conversation_jid: str, analysis_data: dict
+    db: Session,
+    conversation_jid: str,
+    analysis_data: dict,
+    instance_name: Optional[str] = None,
 ):
     """
     Salva/atualiza resultados da análise de IA para uma conversa (chave: instância + JID).
+    Upsert único (ON CONFLICT em conversation_id), sem select-then-update.
     """
-    conversation = (
-        db.query(models.WhatsappConversation)
-        .filter_by(instance_name=instance_name, remote_jid=conversation_jid)
-        .first()
+    conv_q = db.query(models.WhatsappConversation.id).filter(
+        models.WhatsappConversation.remote_jid == conversation_jid
     )
-    if not conversation:
-        conversation = (
-            db.query(models.WhatsappConversation)
-            .filter_by(remote_jid=conversation_jid)
-            .first()
+    if instance_name:
+        # prefere a conversa da instância informada; senão, qualquer uma com o JID
+        conv_q = conv_q.order_by(
+            (models.WhatsappConversation.instance_name == instance_name).desc()
         )
+    conversation_id = conv_q.limit(1).scalar()
 
-    if not conversation:
+    if not conversation_id:
         logger.error(
             f"[{instance_name}] Tentativa de salvar análise para conversa inexistente: {conversation_jid}"
         )
         return
 
-    analysis = (
-        db.query(models.WhatsappAnalysis)
-        .filter_by(conversation_id=conversation.id)
-        .first()
+    values = {
+        "extracted_data": analysis_data.get("extracted_data"),
+        "temperature_assessment": analysis_data.get("temperature_analysis"),
+        "director_decision": analysis_data.get("director_decision"),
+        "guard_report": analysis_data.get("guard_report"),
+        "context": analysis_data.get("context"),
+    }
+    stmt = insert(models.WhatsappAnalysis).values(
+        conversation_id=conversation_id, **values
     )
-    if not analysis:
-        analysis = models.WhatsappAnalysis(conversation_id=conversation.id)
-        db.add(analysis)
-
-    analysis.extracted_data = analysis_data.get("extracted_data")
-    analysis.temperature_assessment = analysis_data.get("temperature_analysis")
-    analysis.director_decision = analysis_data.get("director_decision")
-    analysis.guard_report = analysis_data.get("guard_report")
-    analysis.context = analysis_data.get("context")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["conversation_id"],
+        set_={**values, "updated_at": func.now()},
+    )
+    db.execute(stmt)
+    db.commit()
 
     logger.info(
         f"[{instance_name}] Análise salva/atualizada para a conversa {conversation_jid}."
     )
-    db.commit()
 
 
 # --- Funções do Departamento de E-mail ---
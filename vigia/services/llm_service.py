@@ -1,19 +1,47 @@
+import hashlib
+import json
 import logging
 import httpx
 import google.generativeai as genai
 import asyncio
 import time
+import weakref
 from collections import deque
+from google.api_core import exceptions as google_exceptions
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 from vigia.departments.negotiation_whatsapp.core import tools as whatsapp_tools
 from vigia.departments.negotiation_email.core import tools as email_tools
 
 from ..config import settings
+from . import redis_service
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
 
 # --- Configuração do Rate Limiter para o Gemini ---
 GEMINI_RPM_LIMIT = 1000  # Requisições por minuto
 GEMINI_WINDOW_SECONDS = 60
 gemini_request_timestamps = deque()
+GEMINI_ERROR_RESPONSE = '{"error": "Gemini API call failed"}'
+
+# Erros transitórios do Gemini (429/5xx/timeout) → nova tentativa com backoff exponencial + jitter
+GEMINI_RETRYABLE_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Um semáforo por event loop (asyncio.Semaphore fica preso ao loop em que espera)
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _llm_semaphores.get(loop)
+    if sem is None:
+        sem = _llm_semaphores[loop] = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return sem
 
 if settings.LLM_PROVIDER == "gemini" and settings.GEMINI_API_KEY:
     genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -40,12 +68,23 @@ async def llm_call(
     use_tools: bool = False,
     *,
     expects_json: bool = False,
-    json_schema: dict | None = None
+    json_schema: dict | None = None,
+    use_cache: bool = False
 ) -> str | dict:
     """
     Função AGNÓSTICA e ASSÍNCRONA que chama o provedor de LLM.
     Pode opcionalmente usar function calling.
+    `use_cache=True` (só para chamadas idempotentes, ex.: auditorias de formato) guarda a
+    resposta sem ferramentas no Redis pelo hash do prompt.
     """
+    cache_key = None
+    if use_cache and not use_tools and settings.LLM_CACHE_TTL_SECONDS > 0:
+        cache_key = _llm_cache_key(system_prompt, user_prompt, expects_json, json_schema)
+        cached = await redis_service.get_llm_cache(cache_key)
+        if cached is not None:
+            logging.info("Resposta do LLM servida do cache.")
+            return json.loads(cached)
+
     logging.info(f"Chamando LLM provider (async): {settings.LLM_PROVIDER}")
     raw_response = ""
 
@@ -56,10 +95,12 @@ async def llm_call(
     }
 
     if settings.LLM_PROVIDER == "gemini":
-        raw_response = await _call_gemini_async(
-            system_prompt, user_prompt, use_tools, available_tools,
-            expects_json=expects_json, json_schema=json_schema
-        )
+        # orçamento global de concorrência: todas as agentes disputam as mesmas vagas
+        async with _llm_semaphore():
+            raw_response = await _call_gemini_async(
+                system_prompt, user_prompt, use_tools, available_tools,
+                expects_json=expects_json, json_schema=json_schema
+            )
     else:
         return '{"error": "LLM provider not configured"}'
 
@@ -70,9 +111,40 @@ async def llm_call(
     cleaned_response = _clean_llm_response(raw_response)
     logging.debug(f"Resposta bruta: {raw_response}")
     logging.info(f"Resposta limpa: {cleaned_response}")
+    if cache_key is not None and _is_cacheable(raw_response, cleaned_response, expects_json):
+        await redis_service.set_llm_cache(
+            cache_key, json.dumps(cleaned_response), settings.LLM_CACHE_TTL_SECONDS
+        )
     return cleaned_response
 
 
+def _is_cacheable(raw_response: str, cleaned_response: str, expects_json: bool) -> bool:
+    """Erros do provedor e JSON inválido (quando se espera JSON) não vão para o cache."""
+    if raw_response == GEMINI_ERROR_RESPONSE:
+        return False
+    if expects_json:
+        try:
+            json.loads(cleaned_response)
+        except json.JSONDecodeError:
+            return False
+    return True
+
+
+def _llm_cache_key(system_prompt: str, user_prompt: str, expects_json: bool, json_schema: dict | None) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    for part in (
+        settings.LLM_PROVIDER,
+        GEMINI_MODEL_NAME,
+        system_prompt,
+        user_prompt,
+        str(expects_json),
+        json.dumps(json_schema, sort_keys=True, default=str) if json_schema else "",
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
 async def _call_gemini_async(
     system_prompt: str,
     user_prompt: str,
@@ -99,7 +171,7 @@ async def _call_gemini_async(
     gemini_request_timestamps.append(time.monotonic())
 
     try:
-        model_name = "gemini-2.5-flash"
+        model_name = GEMINI_MODEL_NAME
         generation_config = {}
         if expects_json:
             generation_config["response_mime_type"] = "application/json"
@@ -113,10 +185,17 @@ async def _call_gemini_async(
             generation_config=generation_config
         )
 
-        response = await model.generate_content_async(
-            user_prompt,
-            tool_config={"function_calling_config": "ANY"} if use_tools else None
-        )
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential_jitter(initial=1, max=20),
+            retry=retry_if_exception_type(GEMINI_RETRYABLE_EXCEPTIONS),
+            reraise=True,
+        ):
+            with attempt:
+                response = await model.generate_content_async(
+                    user_prompt,
+                    tool_config={"function_calling_config": "ANY"} if use_tools else None
+                )
 
         if response.candidates and response.candidates[0].content.parts:
             part = response.candidates[0].content.parts[0]
@@ -131,4 +210,4 @@ async def _call_gemini_async(
         return response.text
     except Exception as e:
         logging.error(f"Erro na API do Gemini (async): {e}")
-        return '{"error": "Gemini API call failed"}'
+        return GEMINI_ERROR_RESPONSE
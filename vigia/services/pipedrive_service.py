@@ -5,6 +5,7 @@ from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 import asyncio
 from collections import deque
+from functools import lru_cache
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_exception
 from vigia.departments.negotiation_email.utils.pipedrive_context_mapper import CUSTOM_FIELD_KEYS
 
@@ -143,6 +144,9 @@ def _generate_phone_variations(phone: str) -> list[str]:
         variations.append(f"{phone[:2]} {phone[2:6]}-{phone[6:]}")
     return variations
 
+_NON_DIGIT_RE = re.compile(r"\D")
+
+@lru_cache(maxsize=4096)
 def _clean_phone(raw_phone: str) -> str:
     """
     Normaliza um número de telefone brasileiro para o Pipedrive.
@@ -163,7 +167,7 @@ def _clean_phone(raw_phone: str) -> str:
         return ""
         
     # 1. Manter apenas os dígitos
-    digits = re.sub(r"\D", "", raw_phone)
+    digits = _NON_DIGIT_RE.sub("", raw_phone)
 
     # 2. Remover o código de país "55" no início
     if digits.startswith("55"):
@@ -223,12 +227,15 @@ async def find_person_by_id(client: PipedriveClient, person_id: int) -> Optional
 async def find_deal_by_id(client: PipedriveClient, deal_id: int) -> Optional[Dict[str, Any]]:
     """Busca e formata os detalhes de um deal pelo seu ID, incluindo suas notas."""
     logger.debug(f"Buscando detalhes do deal por ID: {deal_id}")
-    data = await client._request("GET", f"/deals/{deal_id}")
+    # detalhes e notas são independentes: uma ida e volta em vez de duas
+    data, notes_data = await asyncio.gather(
+        client._request("GET", f"/deals/{deal_id}"),
+        client._request("GET", f"/deals/{deal_id}/notes"),
+    )
     if not data: 
         return None
     
     formatted_deal = _format_deal_details(data)
-    notes_data = await client._request("GET", f"/deals/{deal_id}/notes")
     if notes_data:
         formatted_deal["notes"] = [note.get("content", "") for note in notes_data]
     return formatted_deal
@@ -261,6 +268,10 @@ async def find_deals_by_person_id(client: PipedriveClient, person_id: int) -> Op
         
     return None
 
+def phone_from_jid(jid: str) -> str:
+    """Telefone normalizado (ver `_clean_phone`) a partir de um JID do WhatsApp ('5511...@s.whatsapp.net')."""
+    return _clean_phone(jid.split('@', 1)[0])
+
 async def find_person_by_phone(client: PipedriveClient, phone: str) -> Optional[Dict[str, Any]]:
     """
     Busca uma pessoa pelo telefone usando uma estratégia de busca em cascata para
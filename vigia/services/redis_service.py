@@ -1,6 +1,8 @@
 import redis.asyncio as redis
+import asyncio
 import logging
 import json
+import weakref
 from typing import Optional
 
 from vigia.config import settings
@@ -31,17 +33,33 @@ def initialize_redis_client() -> Optional[redis.Redis]:
 # --- Inicialização na importação do módulo ---
 redis_client = initialize_redis_client()
 
+# Conexões do redis.asyncio ficam presas ao loop que as abriu; o worker do Celery roda
+# um asyncio.run por tarefa, então cada loop ganha o seu próprio cliente/pool
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.Redis]" = weakref.WeakKeyDictionary()
+
+
+def _client() -> Optional[redis.Redis]:
+    """Cliente Redis do event loop corrente (None se o Redis não foi inicializado)."""
+    if not redis_client:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        client = _loop_clients[loop] = initialize_redis_client()
+    return client
+
 
 # --- Funções Auxiliares Assíncronas para o Histórico de Conversas ---
 CONVERSATION_TTL = 3600 
 
 async def get_conversation_history(conversation_id: str) -> list[str]:
     """Busca o histórico de mensagens de uma conversa no Redis de forma assíncrona."""
-    if not redis_client:
+    client = _client()
+    if not client:
         logger.error("Cliente Redis não inicializado. Impossível buscar histórico.")
         return []
     
-    history_bytes = await redis_client.get(conversation_id)
+    history_bytes = await client.get(conversation_id)
     
     if not history_bytes:
         return []
@@ -54,7 +72,8 @@ async def get_conversation_history(conversation_id: str) -> list[str]:
 
 async def append_to_conversation_history(conversation_id: str, message: str):
     """Adiciona uma nova mensagem ao histórico de forma assíncrona."""
-    if not redis_client:
+    client = _client()
+    if not client:
         logger.error("Cliente Redis não inicializado. Impossível adicionar ao histórico.")
         return
 
@@ -64,4 +83,30 @@ async def append_to_conversation_history(conversation_id: str, message: str):
     
     history_bytes = json.dumps(history).encode('utf-8')
     
-    await redis_client.set(conversation_id, history_bytes, ex=CONVERSATION_TTL)
\ No newline at end of file
+    await client.set(conversation_id, history_bytes, ex=CONVERSATION_TTL)
+
+
+# --- Cache de respostas do LLM (chave = hash do prompt) ---
+LLM_CACHE_PREFIX = "llm_cache:"
+
+async def get_llm_cache(key: str) -> Optional[str]:
+    """Resposta do LLM em cache (JSON serializado) ou None; falha do Redis conta como miss."""
+    client = _client()
+    if not client:
+        return None
+    try:
+        value = await client.get(LLM_CACHE_PREFIX + key)
+    except Exception:
+        logger.warning("Falha ao ler o cache de LLM no Redis.", exc_info=True)
+        return None
+    return value.decode('utf-8') if value else None
+
+async def set_llm_cache(key: str, value: str, ttl: int):
+    """Grava a resposta do LLM no cache; erros do Redis não interrompem o fluxo."""
+    client = _client()
+    if not client:
+        return
+    try:
+        await client.set(LLM_CACHE_PREFIX + key, value.encode('utf-8'), ex=ttl)
+    except Exception:
+        logger.warning("Falha ao gravar o cache de LLM no Redis.", exc_info=True)